@@ -1,23 +1,46 @@
+import time
+IMPORT_STARTED_AT = time.perf_counter()  # 统计本节点包的导入耗时（ComfyUI启动时间的一部分）
 import os
+import sys
 import json
 import logging
+import hashlib
+import threading
+import asyncio
+import contextvars
+import codecs
+import functools
+import importlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, namedtuple
 from aiohttp import web
 import folder_paths
-from server import PromptServer  # 导入 ComfyUI 服务器实例
 
-from PIL import Image
-import io
-import mimetypes
+# 预编译命令行（precompile.py）独立运行时不导入ComfyUI的server模块（会连带导入nodes、execution和torch），也不注册路由
+STANDALONE = os.environ.get("PS_COMFY_TIHEAVEN_STANDALONE") == "1"
+if STANDALONE:
+    PromptServer = None
+else:
+    from server import PromptServer  # 导入 ComfyUI 服务器实例
 
-from comfy_execution.graph_utils import GraphBuilder, Node  # 导入graph_utils中的工具类
+# PIL、mimetypes、graph_utils、watchdog、brotli、zstandard、multiprocessing、cProfile 在首次使用的函数内导入，不计入ComfyUI启动时间
+import io
+import gzip
+import base64
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("Ps-Comfy-TiHeaveN-WorkflowRouteHook")
 
+def get_prompt_server():
+    """返回ComfyUI的PromptServer实例；独立运行或服务器尚未创建（upstream只在 __init__ 中设置 instance）时返回None"""
+    return getattr(PromptServer, "instance", None)
+
+
 # 获取 ComfyUI 默认工作流目录（user/default/workflows）
 def get_default_workflow_dir():
-    """动态获取 ComfyUI 标准工作流目录，避免硬编码"""
+    """动态获取 ComfyUI 标准工作流目录，避免硬编码（目录在首个插件请求时由 run_deferred_init 创建）"""
     # 优先通过 folder_paths 获取 user 目录
     user_root = folder_paths.get_directory_by_type("user")
     if not user_root:
@@ -25,70 +48,933 @@ def get_default_workflow_dir():
         user_root = os.path.join(folder_paths.base_path, "user")
     
     # 构建标准工作流路径：user/default/workflows
-    workflow_dir = os.path.join(user_root, "default", "workflows")
-    # 确保目录存在（首次使用时自动创建）
-    os.makedirs(workflow_dir, exist_ok=True)
-    return workflow_dir
+    return os.path.join(user_root, "default", "workflows")
 
 # 初始化工作流目录
 WORKFLOW_DIR = get_default_workflow_dir()
 #logger.info(f"已挂钩工作流目录: {WORKFLOW_DIR}")
 
 
-def convert_workflow_format(original_workflow):
-    """将原始工作流格式转换为目标格式，忽略mode=4和Reroute节点并保持连接正确，同时按规则处理widget值和title"""
-    builder = GraphBuilder(prefix="")  # 使用空前缀以便保持原始ID
-    nodes = original_workflow.get("nodes", [])
-    links = original_workflow.get("links", [])  # links格式: [link_id, 源节点id, 源输出索引, 目标节点id, 目标输入索引, 类型]
+def get_env_int(name, default):
+    """读取整数型环境变量，未设置或格式错误时使用默认值"""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"环境变量 {name}={value} 不是有效整数，已使用默认值 {default}")
+        return default
 
-    # 第一步：收集所有被忽略的节点ID（mode=4或类型为Reroute）和正常节点ID
-    ignore_node_ids = set()
-    normal_node_ids = set()
-    for node in nodes:
-        node_id = str(node["id"])
-        # 忽略mode=4的节点和Reroute节点
+
+def get_env_bool(name, default=False):
+    """读取布尔型环境变量（1/true/yes/on 视为开启）"""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def create_process_pool(max_workers):
+    """
+    创建基于fork的进程池，只用于没有其它线程的预编译命令行进程；平台不支持fork时返回None（spawn方式会在子进程中重新导入ComfyUI主程序）
+    运行中的ComfyUI进程有大量工作线程，在其中fork会把它们持有的锁（如logging）复制到子进程导致死锁，服务器内只使用线程池
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork"))
+
+
+class LRUCache:
+    """按字节数限制容量的线程安全LRU缓存"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        # 单个条目超过总容量时不缓存，避免把其它条目全部挤出
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._current_bytes -= old_entry[1]
+            self._entries[key] = (value, size)
+            self._current_bytes += size
+            # 超出容量时淘汰最久未使用的条目
+            while self._current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._current_bytes -= evicted_size
+
+    def __contains__(self, key):
+        """只判断是否存在，不计入命中统计也不刷新访问顺序"""
+        with self._lock:
+            return key in self._entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def current_bytes(self):
+        return self._current_bytes
+
+
+class DiskCache:
+    """基于目录的内容寻址缓存：文件名即缓存键，按总字节数做LRU淘汰（访问时刷新文件修改时间，重启后顺序仍有效）"""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = None  # key -> size，按最近访问排序；首次使用时扫描目录建立
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_path(self, key):
+        # 按键前两位分子目录，避免单目录文件过多
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _ensure_loaded(self):
+        if self._entries is not None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for root, _, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name, stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((name, size) for _, name, size in found)
+        self._current_bytes = sum(size for _, _, size in found)
+        self._evict()
+
+    def _evict(self):
+        while self._current_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._current_bytes -= size
+            try:
+                os.remove(self._get_path(key))
+            except OSError:
+                pass
+
+    def get(self, key):
+        with self._lock:
+            self._ensure_loaded()
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._get_path(key)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                # 文件被外部删除，同步移除索引
+                self._current_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def __contains__(self, key):
+        """只判断是否存在，不计入命中统计也不刷新访问顺序"""
+        with self._lock:
+            self._ensure_loaded()
+            return key in self._entries
+
+    def put(self, key, data):
+        with self._lock:
+            self._ensure_loaded()
+            path = self._get_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，避免并发读到不完整的内容
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            old_size = self._entries.pop(key, None)
+            if old_size is not None:
+                self._current_bytes -= old_size
+            self._entries[key] = len(data)
+            self._current_bytes += len(data)
+            self._evict()
+
+    @property
+    def current_bytes(self):
+        return self._current_bytes
+
+
+# 缓存的响应体：序列化后的字节、ETag、最后修改时间（时间戳）、预压缩版本（编码 -> 字节，可为空）
+CachedResponse = namedtuple("CachedResponse", ["body", "etag", "last_modified", "encodings"], defaults=(None,))
+
+# 转换后工作流的内存缓存，容量可通过环境变量调整（单位MB）
+WORKFLOW_CACHE = LRUCache(get_env_int("PS_COMFY_TIHEAVEN_WORKFLOW_CACHE_MB", 64) * 1024 * 1024)
+
+
+# 指标开关：关闭后路由和计时钩子不做任何记录（指标路由仍输出缓存与执行器的即时状态）
+METRICS_ENABLED = get_env_bool("PS_COMFY_TIHEAVEN_METRICS", True)
+# 耗时直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_metric_labels(labels):
+    """把 ((名称, 值), ...) 格式化为Prometheus标签字符串"""
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class MetricsRegistry:
+    """进程内指标：计数器和直方图按 (指标名, 标签) 累计，输出Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics = {}  # 指标名 -> (类型, 说明, {标签: 值})
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        with self._lock:
+            self._metrics.setdefault(name, (kind, help_text, {}))
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            series = self._metrics.setdefault(name, ("counter", "", {}))[2]
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, value, labels=()):
+        with self._lock:
+            series = self._metrics.setdefault(name, ("histogram", "", {}))[2]
+            histogram = series.get(labels)
+            if histogram is None:
+                # [各桶计数..., 总和, 总数]
+                histogram = series[labels] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def render(self):
+        """输出Prometheus文本格式"""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, series) in self._metrics.items():
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in series.items():
+                    if kind != "histogram":
+                        lines.append(f"{name}{format_metric_labels(labels)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS, value):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', '+Inf'),))} {value[-1]}")
+                    lines.append(f"{name}_sum{format_metric_labels(labels)} {value[-2]}")
+                    lines.append(f"{name}_count{format_metric_labels(labels)} {value[-1]}")
+        return lines
+
+
+METRICS = MetricsRegistry()
+METRICS.describe("ps_comfy_tiheaven_http_requests_total", "counter", "Requests handled per route, method and status")
+METRICS.describe("ps_comfy_tiheaven_http_request_duration_seconds", "histogram", "Request latency per route")
+METRICS.describe("ps_comfy_tiheaven_convert_duration_seconds", "histogram", "Workflow conversion time by view and node/link count class")
+METRICS.describe("ps_comfy_tiheaven_thumbnail_phase_seconds", "histogram", "Thumbnail decode/resize/encode time by image mode")
+
+
+def metric_clock():
+    """计时钩子的起点；指标关闭时返回None，后续的 observe_since 直接跳过"""
+    return time.perf_counter() if METRICS_ENABLED else None
+
+
+def observe_since(name, started_at, labels=()):
+    """记录从 started_at 到现在的耗时并返回当前时间，便于连续记录多个阶段"""
+    if started_at is None:
+        return None
+    now = time.perf_counter()
+    METRICS.observe(name, now - started_at, labels)
+    return now
+
+
+def size_class(count, bounds=(50, 200, 1000)):
+    """把数量归入区间标签（如 50-199），避免标签取值过多"""
+    lower = 0
+    for bound in bounds:
+        if count < bound:
+            return f"{lower}-{bound - 1}"
+        lower = bound
+    return f"{lower}+"
+
+
+class BlockingExecutor:
+    """所有路由共享的有界执行器：阻塞I/O和CPU密集任务都在线程池执行，按类型分别统计排队深度和耗时"""
+
+    def __init__(self, max_workers, max_pending):
+        self.max_workers = max_workers
+        self.max_pending = max_pending  # 同时提交（排队+执行中）的任务上限，超出时在事件循环内等待
+        self._thread_pool = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self._stats = {
+            kind: {
+                "in_flight": 0,  # 已提交未完成
+                "queued": 0,  # 已提交未开始
+                "completed": 0,
+                "failed": 0,
+                "total_wait": 0.0,
+                "total_latency": 0.0,
+                "max_latency": 0.0,
+            }
+            for kind in ("io", "cpu")
+        }
+
+    def _get_thread_pool(self):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="ps-comfy-tiheaven"
+            )
+        return self._thread_pool
+
+    def _timed_call(self, kind, submitted_at, func, args):
+        """在线程池中执行，记录任务开始前的排队时间"""
+        started_at = time.perf_counter()
+        with self._lock:
+            stats = self._stats[kind]
+            stats["queued"] -= 1
+            stats["total_wait"] += started_at - submitted_at
+        return func(*args)
+
+    async def run(self, func, *args, cpu_bound=False):
+        """在执行器中运行阻塞函数并等待结果；cpu_bound=True 的任务计入cpu类统计"""
+        kind = "cpu" if cpu_bound else "io"
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+
+        async with self._semaphore:
+            stats = self._stats[kind]
+            submitted_at = time.perf_counter()
+            with self._lock:
+                stats["in_flight"] += 1
+                stats["queued"] += 1
+            failed = True
+            try:
+                result = await loop.run_in_executor(
+                    self._get_thread_pool(), self._timed_call, kind, submitted_at, func, args
+                )
+                failed = False
+                return result
+            finally:
+                latency = time.perf_counter() - submitted_at
+                with self._lock:
+                    stats["in_flight"] -= 1
+                    stats["failed" if failed else "completed"] += 1
+                    stats["total_latency"] += latency
+                    stats["max_latency"] = max(stats["max_latency"], latency)
+
+    @property
+    def in_flight(self):
+        """已提交未完成的任务总数"""
+        return sum(stats["in_flight"] for stats in self._stats.values())
+
+    def get_stats(self):
+        """返回各类任务的排队深度与耗时统计（毫秒）"""
+        with self._lock:
+            result = {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+            }
+            for kind, stats in self._stats.items():
+                finished = stats["completed"] + stats["failed"]
+                result[kind] = {
+                    "in_flight": stats["in_flight"],
+                    "queued": stats["queued"],
+                    "completed": stats["completed"],
+                    "failed": stats["failed"],
+                    "avg_wait_ms": round(stats["total_wait"] / finished * 1000, 3) if finished else 0.0,
+                    "avg_latency_ms": round(stats["total_latency"] / finished * 1000, 3) if finished else 0.0,
+                    "max_latency_ms": round(stats["max_latency"] * 1000, 3),
+                }
+            return result
+
+
+# 共享执行器：线程数、排队上限均可通过环境变量调整
+EXECUTOR = BlockingExecutor(
+    max_workers=get_env_int("PS_COMFY_TIHEAVEN_IO_WORKERS", 4),
+    max_pending=get_env_int("PS_COMFY_TIHEAVEN_MAX_PENDING", 64),
+)
+
+
+# 每个客户端同时进行的实际计算（未命中内存缓存的转换、缩略图和区域预览）上限，超出时返回429；0表示不限制
+CLIENT_CONCURRENCY = get_env_int("PS_COMFY_TIHEAVEN_CLIENT_CONCURRENCY", 0)
+# 区分客户端的请求头（如反向代理写入的 X-Forwarded-For，取第一个地址）；留空时按连接的对端地址区分
+# 反向代理后面所有用户的对端地址相同，会共用一个名额；只应配置由代理覆盖写入、客户端无法伪造的请求头
+CLIENT_KEY_HEADER = os.environ.get("PS_COMFY_TIHEAVEN_CLIENT_KEY_HEADER", "").strip()
+# 429响应建议的重试间隔（秒）
+CLIENT_RETRY_AFTER = 1
+# 当前请求的客户端，由 limit_client_concurrency 设置；未设置时（如预热线程、CLI）不受限制
+CURRENT_CLIENT = contextvars.ContextVar("ps_comfy_tiheaven_client", default=None)
+# 为True时超限的计算等待名额而不是抛出 ClientLimitExceeded（批量请求的各项）
+CLIENT_LIMIT_WAIT = contextvars.ContextVar("ps_comfy_tiheaven_client_limit_wait", default=False)
+
+
+class ClientLimitExceeded(Exception):
+    """客户端进行中的计算数已达上限"""
+
+    def __init__(self, client):
+        super().__init__(f"客户端 {client} 进行中的请求过多")
+        self.client = client
+
+
+class ClientLimiter:
+    """
+    按客户端统计进行中的计算数，超过上限时拒绝而不是继续排队，避免单个客户端占满共享执行器
+    只在 SingleFlight 发起新计算时占用名额：内存缓存命中、304和合并到进行中计算的请求不计入
+    批量请求的各项在事件循环中排队等待名额，不会因同一批量请求自身的并发被拒绝
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._active = {}  # 客户端 -> 进行中的计算数
+        self._waiters = {}  # 客户端 -> 等待名额的 Future 列表
+        self.rejected = 0
+
+    def acquire(self, client):
+        active = self._active.get(client, 0)
+        if active >= self.limit:
+            self.rejected += 1
+            return False
+        self._active[client] = active + 1
+        return True
+
+    async def wait_acquire(self, client):
+        """等待直到占用一个名额"""
+        while True:
+            active = self._active.get(client, 0)
+            if active < self.limit:
+                self._active[client] = active + 1
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            waiters = self._waiters.setdefault(client, [])
+            waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 已被唤醒却随即取消（如批量请求的客户端断开）时，把名额让给下一个等待者
+                if waiter.done() and not waiter.cancelled():
+                    self._wake(client)
+                raise
+            finally:
+                waiters.remove(waiter)
+                if not waiters:
+                    self._waiters.pop(client, None)
+
+    def _wake(self, client):
+        for waiter in self._waiters.get(client, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def release(self, client):
+        active = self._active.pop(client) - 1
+        if active:
+            self._active[client] = active
+        self._wake(client)
+
+    async def acquire_current(self):
+        """
+        为当前请求的客户端占用一个名额，返回计算结束时调用的释放函数；无需限制时返回None
+        已达上限时抛出 ClientLimitExceeded，CLIENT_LIMIT_WAIT 为True时改为等待名额
+        """
+        client = CURRENT_CLIENT.get()
+        if self.limit <= 0 or client is None:
+            return None
+        if CLIENT_LIMIT_WAIT.get():
+            await self.wait_acquire(client)
+        elif not self.acquire(client):
+            raise ClientLimitExceeded(client)
+        return lambda _task: self.release(client)
+
+    def get_stats(self):
+        return {
+            "limit": self.limit, "clients": len(self._active), "in_flight": sum(self._active.values()),
+            "waiting": sum(len(waiters) for waiters in self._waiters.values()), "rejected": self.rejected,
+        }
+
+
+CLIENT_LIMITER = ClientLimiter(CLIENT_CONCURRENCY)
+
+
+class SingleFlight:
+    """
+    进行中请求合并：同一键的并发调用共享一次计算，键与对应缓存的键相同（文件签名 + 参数）
+    计算在独立任务中执行，发起请求的客户端断开不会取消其它等待者的结果
+    客户端并发达到上限时发起新计算抛出 ClientLimitExceeded，合并到进行中的计算不受限制
+    """
+
+    def __init__(self):
+        self._pending = {}  # (类别, 键) -> asyncio.Task
+        self.stats = {}  # 类别 -> {"started": 实际计算次数, "coalesced": 合并到进行中计算的次数}
+
+    async def run(self, kind, key, coro_fn):
+        flight_key = (kind, key)
+        stats = self.stats.setdefault(kind, {"started": 0, "coalesced": 0})
+        task = self._pending.get(flight_key)
+        if task is None:
+            # 新计算占用发起请求的客户端的并发名额，直到计算结束（即使该客户端已断开）
+            release = await CLIENT_LIMITER.acquire_current()
+            # 等待名额期间其它请求可能已发起相同的计算
+            task = self._pending.get(flight_key)
+            if task is not None and release is not None:
+                release(task)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn())
+            self._pending[flight_key] = task
+            task.add_done_callback(functools.partial(self._finish, flight_key))
+            if release is not None:
+                task.add_done_callback(release)
+            stats["started"] += 1
+        else:
+            stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, flight_key, task):
+        self._pending.pop(flight_key, None)
+        # 所有等待者都已断开时读取异常，避免事件循环报告未获取的异常
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self):
+        return {kind: dict(stats, in_flight=sum(1 for key in self._pending if key[0] == kind))
+                for kind, stats in self.stats.items()}
+
+
+SINGLE_FLIGHT = SingleFlight()
+
+
+def get_file_signature(filepath):
+    """返回 (路径, 修改时间ns, 文件大小)，作为缓存键；文件变化后键随之变化"""
+    stat = os.stat(filepath)
+    return (filepath, stat.st_mtime_ns, stat.st_size)
+
+
+def make_etag(body):
+    """根据响应内容生成强ETag"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def is_not_modified(request, etag, last_modified):
+    """判断条件请求是否命中（If-None-Match 优先于 If-Modified-Since）"""
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # 弱比较：忽略W/前缀
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+    if_modified_since = request.if_modified_since
+    if if_modified_since is not None and last_modified is not None:
+        return int(last_modified) <= int(if_modified_since.timestamp())
+    return False
+
+
+# 压缩编码的优先顺序（客户端同时接受且q值相同时优先选择靠前的）
+ENCODING_PREFERENCE = ("zstd", "br", "gzip")
+# br/zstd 依赖的可选包
+OPTIONAL_ENCODING_MODULES = {"br": "brotli", "zstd": "zstandard"}
+# 压缩档位（体积与耗时的取舍）：fast 最快、balanced 兼顾、max 体积最小
+COMPRESSION_LEVELS = {
+    "fast": {"gzip": 1, "br": 1, "zstd": 1},
+    "balanced": {"gzip": 6, "br": 5, "zstd": 3},
+    "max": {"gzip": 9, "br": 11, "zstd": 19},
+}
+COMPRESSION_PROFILE = os.environ.get("PS_COMFY_TIHEAVEN_COMPRESSION", "balanced").strip().lower()
+if COMPRESSION_PROFILE not in COMPRESSION_LEVELS:
+    logger.warning(f"未知的压缩档位 {COMPRESSION_PROFILE}，已使用 balanced")
+    COMPRESSION_PROFILE = "balanced"
+# 小于该字节数的响应不压缩
+COMPRESSION_MIN_SIZE = 1024
+# 压缩节省统计：编码 -> {"responses", "original_bytes", "sent_bytes"}
+COMPRESSION_STATS = {}
+
+
+@functools.lru_cache(maxsize=None)
+def get_available_encodings():
+    """当前环境可用的压缩编码（按优先顺序）；首次调用时才尝试导入可选包"""
+    available = []
+    for encoding in ENCODING_PREFERENCE:
+        module = OPTIONAL_ENCODING_MODULES.get(encoding)
+        if module is not None:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                continue
+        available.append(encoding)
+    return tuple(available)
+
+
+def compress(body, encoding, profile=None):
+    """按指定编码和档位压缩响应体"""
+    level = COMPRESSION_LEVELS[profile or COMPRESSION_PROFILE][encoding]
+    if encoding == "gzip":
+        # mtime=0 使相同内容的压缩结果保持一致
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    if encoding == "br":
+        import brotli
+
+        return brotli.compress(body, quality=level)
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    raise ValueError(f"不支持的压缩编码: {encoding}")
+
+
+def compress_body(body, profile="max"):
+    """预先计算响应体所有可用编码的压缩版本（用于很少变化的静态内容），返回 {编码: 字节}"""
+    return {encoding: compress(body, encoding, profile) for encoding in get_available_encodings()}
+
+
+async def ensure_encoding(request, cached):
+    """按Accept-Encoding选出编码，缓存条目中还没有该压缩版本时在执行器中压缩并存入条目"""
+    if cached.encodings is None or len(cached.body) < COMPRESSION_MIN_SIZE:
+        return
+    encoding = choose_encoding(request, get_available_encodings())
+    if encoding is not None and encoding not in cached.encodings:
+        cached.encodings[encoding] = await EXECUTOR.run(compress, cached.body, encoding, cpu_bound=True)
+
+
+def record_compression(encoding, original_size, sent_size):
+    """累计压缩节省的字节数"""
+    stats = COMPRESSION_STATS.setdefault(encoding, {"responses": 0, "original_bytes": 0, "sent_bytes": 0})
+    stats["responses"] += 1
+    stats["original_bytes"] += original_size
+    stats["sent_bytes"] += sent_size
+    logger.debug(f"{encoding} 压缩: {original_size} -> {sent_size} 字节")
+
+
+def get_compression_stats():
+    """返回各编码的压缩响应数、原始/实际发送字节数和节省比例"""
+    return {
+        encoding: {
+            **stats,
+            "saved_ratio": round(1 - stats["sent_bytes"] / stats["original_bytes"], 4) if stats["original_bytes"] else 0.0
+        }
+        for encoding, stats in COMPRESSION_STATS.items()
+    }
+
+
+def choose_encoding(request, encodings):
+    """根据请求的Accept-Encoding（含q值）从可用的预压缩版本中选择编码，不可用时返回None"""
+    if not encodings:
+        return None
+    accepted = {}
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        token, _, params = part.partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token] = quality
+    # q值高者优先，q值相同时按 ENCODING_PREFERENCE 的顺序
+    best_encoding = None
+    best_quality = 0.0
+    for encoding in ENCODING_PREFERENCE:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if encoding in encodings and quality > best_quality:
+            best_encoding = encoding
+            best_quality = quality
+    return best_encoding
+
+
+class PrecompressedResponse(web.Response):
+    """
+    已带 Content-Encoding 的响应：忽略中间件再次开启的压缩
+    ComfyUI 以 --enable-compress-response-body 启动时，其中间件会对JSON响应调用 enable_compression，
+    aiohttp 会把已压缩的正文再压缩一次并覆盖 Content-Encoding，客户端无法解码
+    """
+
+    def enable_compression(self, *args, **kwargs):
+        if "Content-Encoding" in self.headers:
+            return
+        super().enable_compression(*args, **kwargs)
+
+
+def make_cached_response(request, cached, content_type, headers=None, charset=None, status=200):
+    """根据缓存条目构建响应：按Accept-Encoding返回预压缩版本，条件请求命中时返回304"""
+    encoding = choose_encoding(request, cached.encodings)
+    # 不同编码是不同的表示，使用各自的强ETag
+    etag = cached.etag if encoding is None else f'{cached.etag[:-1]}-{encoding}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", **(headers or {})}
+    if cached.encodings is not None:
+        headers.setdefault("Vary", "Accept-Encoding")
+    if is_not_modified(request, etag, cached.last_modified):
+        response = web.Response(status=304, headers=headers)
+    else:
+        body = cached.body
+        if encoding is not None:
+            body = cached.encodings[encoding]
+            headers["Content-Encoding"] = encoding
+            record_compression(encoding, len(cached.body), len(body))
+        response = PrecompressedResponse(
+            status=status, body=body, content_type=content_type, charset=charset, headers=headers
+        )
+    response.last_modified = cached.last_modified
+    return response
+
+
+class WorkflowGraph:
+    """工作流图索引层：每次转换只建立一次 link/节点索引，并缓存穿透被忽略节点后解析出的上游源"""
+
+    def __init__(self, nodes, links):
+        self.nodes = nodes
+        # links格式: [link_id, 源节点id, 源输出索引, 目标节点id, 目标输入索引, 类型]
+        # 重复的link_id保留第一条，与原先线性扫描命中第一条的行为一致
+        self.link_index = {}
+        for link in links:
+            if link:
+                self.link_index.setdefault(link[0], link)
+
+        self.node_index = {}
+        # 收集所有被忽略的节点ID（mode=4或类型为Reroute）和正常节点ID
+        self.ignore_node_ids = set()
+        self.normal_node_ids = set()
+        for node in nodes:
+            node_id = str(node["id"])
+            self.node_index.setdefault(node_id, node)
+            if self.is_ignored_node(node):
+                self.ignore_node_ids.add(node_id)
+            else:
+                self.normal_node_ids.add(node_id)
+
+        # link_id -> (源节点ID, 输出索引) 或 None，同一条被忽略节点链只解析一次
+        self._source_cache = {}
+
+    @staticmethod
+    def is_ignored_node(node):
+        """判断节点是否应被忽略"""
         ignore_conditions = [
             node.get("mode") == 4,
             node.get("type") == "Reroute",
             # 新增：判断inputs和outputs是否均为空数组
             (node.get("inputs", []) == [] and node.get("outputs", []) == [])
         ]
-        # 满足任意一个忽略条件则加入忽略集合
-        if any(ignore_conditions):
-            ignore_node_ids.add(node_id)
-        else:
-            normal_node_ids.add(node_id)
+        # 满足任意一个忽略条件即忽略
+        return any(ignore_conditions)
 
-    # 辅助函数：根据输出类型匹配被忽略节点的对应输入
-    def get_corresponding_input(ignored_node, output_type):
+    @staticmethod
+    def get_corresponding_input(ignored_node):
+        """找到被忽略节点用于穿透的输入（第一个带链接的输入）"""
         for input_data in ignored_node.get("inputs", []):
             if input_data.get("link") is not None:
                 return input_data
         return None
 
-    # 辅助函数：递归找到上游第一个正常节点（穿透被忽略节点）
-    def find_original_source(link_id):
-        for link in links:
-            if link[0] == link_id:  # link[0]是link_id
-                source_node_id = str(link[1])  # 源节点ID
-                source_out_idx = link[2]       # 源节点输出索引
-                output_type = link[5]          # 链接类型（即源节点输出类型）
-
-                if source_node_id in normal_node_ids:
-                    return [source_node_id, source_out_idx]
-                elif source_node_id in ignore_node_ids:
-                    source_node = next((n for n in nodes if str(n["id"]) == source_node_id), None)
-                    if not source_node:
-                        return None
-                    corresponding_input = get_corresponding_input(source_node, output_type)
-                    if corresponding_input and corresponding_input.get("link") is not None:
-                        return find_original_source(corresponding_input["link"])
-        return None
+    def find_original_source(self, link_id):
+        """沿链接向上游穿透被忽略节点，返回第一个正常节点的 (节点ID, 输出索引)；无法解析或遇到环路时返回None"""
+        visited = []
+        seen = set()
+        result = None
+        current = link_id
+        while True:
+            if current in self._source_cache:
+                result = self._source_cache[current]
+                break
+            if current in seen:
+                # Reroute/静音节点首尾相连形成环路，原递归实现会在这里栈溢出
+                logger.warning(f"检测到被忽略节点组成的环路（link {current}），该输入已忽略")
+                break
+            seen.add(current)
+            visited.append(current)
+
+            link = self.link_index.get(current)
+            if link is None:
+                break
+            source_node_id = str(link[1])  # 源节点ID
+            if source_node_id in self.normal_node_ids:
+                result = (source_node_id, link[2])  # link[2]是源节点输出索引
+                break
+            if source_node_id not in self.ignore_node_ids:
+                break
+            corresponding_input = self.get_corresponding_input(self.node_index[source_node_id])
+            if corresponding_input is None:
+                break
+            current = corresponding_input["link"]
+
+        # 整条路径上的link都指向同一个结果，一次性写入缓存
+        for visited_link_id in visited:
+            self._source_cache[visited_link_id] = result
+        return result
+
+
+# widgets_values 中种子控制选项的取值（不是实际参数值）
+WIDGET_CONTROL_VALUES = {"randomize", "fixed", "increment", "decrement"}
+
+
+def has_list_in_dict(value):
+    """检查值是否为字典且包含列表类型的值"""
+    # 若值是字典，且字典中至少有一个值是列表，则返回True
+    return isinstance(value, dict) and any(isinstance(v, list) for v in value.values())
+
+
+def get_node_meta(node):
+    """构建节点的_meta信息（title和order）"""
+    class_type = node["type"]
+    # 处理title
+    node_title = node.get("title")
+    if node_title is None:
+        properties = node.get("properties", {})
+        node_title = properties.get("Node name for S&R", "")
+        if not node_title:
+            node_title = class_type
+
+    node_order = node.get("order")
+
+    _meta = {}
+    if node_title:
+        _meta["title"] = node_title
+    if node_order is not None:  # 仅当order存在时添加，避免多余的None值
+        _meta["order"] = node_order
+    return _meta
+
+
+def extract_node_inputs(node_id, node, resolve_link=None):
+    """
+    处理单个节点的输入，返回 (inputs, localized_names, types)
+    resolve_link 用于把链接解析为上游源；为None时跳过链接输入的值，只提取widget值
+    """
+    inputs = {}
+    localized_names = []
+    types = []
+
+    # 收集带widget的输入名称（按输入顺序），并建立名称到序号的索引
+    widget_input_names = [
+        inp["name"] for inp in node.get("inputs", [])
+        if inp.get("widget") is not None
+    ]
+    widget_indexes = {}
+    for widget_index, widget_name in enumerate(widget_input_names):
+        widget_indexes.setdefault(widget_name, widget_index)
+
+    # 过滤widgets_values中的"randomize"
+    filtered_widget_values = [
+        v for v in node.get("widgets_values", [])
+        #if v not in strings_to_filter
+        if not isinstance(v, list) and v not in WIDGET_CONTROL_VALUES  # 新增列表类型判断
+    ]
+
+    for input_data in node.get("inputs", []):
+        input_name = input_data["name"]
+
+        # -------------------------- 修正后的过滤逻辑 --------------------------
+        # 当字段值为字典，且字典中包含列表时，忽略该字段（不限制字段名）
+        # 1. 先获取当前字段的值（可能来自link或widget）
+        current_value = None
+        original_source = None
+        if input_data.get("link") is not None:
+            # 从链接获取值（通常是上游节点引用，格式为(节点ID, 输出索引)），结果由graph缓存
+            if resolve_link is not None:
+                original_source = resolve_link(input_data["link"])
+            current_value = original_source
+        else:
+            # 从widget获取值
+            if input_data.get("widget") is not None:
+                widget_index = widget_indexes.get(input_name)
+                if widget_index is not None and widget_index < len(filtered_widget_values):
+                    current_value = filtered_widget_values[widget_index]
+
+        # 2. 检查是否符合过滤条件：值是字典，且字典中包含列表
+        if has_list_in_dict(current_value):
+            #logger.info(f"节点 {node_id} 的字段 {input_name} 值为含列表的字典，已跳过")
+            continue  # 跳过当前字段的所有处理
+        # -----------------------------------------------------------------
+
+        # 处理localized_names
+        label = input_data.get("label")
+        localized_name = input_data.get("localized_name")
+        display_value = label if label is not None else localized_name
+        if display_value is not None:
+            localized_names.append({input_name: display_value})
+
+        # 处理types
+        if input_data.get("widget") is not None:
+            input_type = input_data.get("type")
+            if input_type is not None:
+                types.append({input_name: input_type})
+
+        # 处理输入链接或widget值（已通过过滤逻辑的字段才会执行到这里）
+        if input_data.get("link") is not None:
+            if resolve_link is None:
+                continue
+            if original_source:
+                inputs[input_name] = original_source
+            else:
+                logger.warning(f"节点 {node_id} 的输入 {input_name} 无法找到有效源，已忽略")
+        else:
+            if input_data.get("widget") is not None:
+                widget_index = widget_indexes.get(input_name)
+                if widget_index is None:
+                    logger.warning(f"节点 {node_id} 的输入 {input_name} 不在widget输入列表中")
+                elif widget_index < len(filtered_widget_values):
+                    inputs[input_name] = filtered_widget_values[widget_index]
+                else:
+                    logger.warning(f"节点 {node_id} 的输入 {input_name} 没有对应的widget值（过滤后）")
+
+    return inputs, localized_names, types
+
+
+def convert_workflow_format(original_workflow):
+    """将原始工作流格式转换为目标格式，忽略mode=4和Reroute节点并保持连接正确，同时按规则处理widget值和title"""
+    from comfy_execution.graph_utils import GraphBuilder  # 导入graph_utils中的工具类
+
+    builder = GraphBuilder(prefix="")  # 使用空前缀以便保持原始ID
+    nodes = original_workflow.get("nodes", [])
+    links = original_workflow.get("links", [])
 
-    # 新增辅助函数：检查值是否为字典且包含列表类型的值
-    def has_list_in_dict(value):
-        # 若值是字典，且字典中至少有一个值是列表，则返回True
-        return isinstance(value, dict) and any(isinstance(v, list) for v in value.values())
+    # 第一步：建立索引并区分被忽略节点和正常节点
+    graph = WorkflowGraph(nodes, links)
+    ignore_node_ids = graph.ignore_node_ids
 
     # 第二步：只添加正常节点（mode≠4），并处理输入链接、title、localized_names和types
     for node in nodes:
@@ -96,106 +982,14 @@ def convert_workflow_format(original_workflow):
         if node_id in ignore_node_ids:
             continue  # 跳过被忽略节点
 
-        class_type = node["type"]
-        # 处理title
-        node_title = node.get("title")
-        if node_title is None:
-            properties = node.get("properties", {})
-            node_title = properties.get("Node name for S&R", "")
-            if not node_title:
-                node_title = class_type
+        inputs, localized_names, types = extract_node_inputs(node_id, node, graph.find_original_source)
 
-        node_order = node.get("order")
-        
-        inputs = {}
-        localized_names = []
-        types = []
-        
-        # 收集带widget的输入名称（按输入顺序）
-        widget_input_names = [
-            inp["name"] for inp in node.get("inputs", [])
-            if inp.get("widget") is not None
-        ]
-        
-        # 过滤widgets_values中的"randomize"
-        strings_to_filter = {"randomize", "fixed", "increment", "decrement"}
-        filtered_widget_values = [
-            v for v in node.get("widgets_values", []) 
-            #if v not in strings_to_filter
-            if not isinstance(v, list) and v not in strings_to_filter  # 新增列表类型判断
-        ]
-        
-        for input_data in node.get("inputs", []):
-            input_name = input_data["name"]
-            
-            # -------------------------- 修正后的过滤逻辑 --------------------------
-            # 当字段值为字典，且字典中包含列表时，忽略该字段（不限制字段名）
-            # 1. 先获取当前字段的值（可能来自link或widget）
-            current_value = None
-            if input_data.get("link") is not None:
-                # 从链接获取值（通常是上游节点引用，格式为[节点ID, 输出索引]）
-                original_source = find_original_source(input_data["link"])
-                current_value = original_source
-            else:
-                # 从widget获取值
-                if input_data.get("widget") is not None:
-                    try:
-                        widget_index = widget_input_names.index(input_name)
-                        if widget_index < len(filtered_widget_values):
-                            current_value = filtered_widget_values[widget_index]
-                    except ValueError:
-                        pass  # 不在widget列表中，不处理
-            
-            # 2. 检查是否符合过滤条件：值是字典，且字典中包含列表
-            if has_list_in_dict(current_value):
-                #logger.info(f"节点 {node_id} 的字段 {input_name} 值为含列表的字典，已跳过")
-                continue  # 跳过当前字段的所有处理
-            # -----------------------------------------------------------------
-
-            # 处理localized_names
-            label = input_data.get("label")
-            localized_name = input_data.get("localized_name")
-            display_value = label if label is not None else localized_name
-            if display_value is not None:
-                localized_names.append({input_name: display_value})
-            
-            # 处理types
-            if input_data.get("widget") is not None:
-                input_type = input_data.get("type")
-                if input_type is not None:
-                    types.append({input_name: input_type})
-            
-            # 处理输入链接或widget值（已通过过滤逻辑的字段才会执行到这里）
-            if input_data.get("link") is not None:
-                original_source = find_original_source(input_data["link"])
-                if original_source:
-                    inputs[input_name] = tuple(original_source)
-                else:
-                    logger.warning(f"节点 {node_id} 的输入 {input_name} 无法找到有效源，已忽略")
-            else:
-                if input_data.get("widget") is not None:
-                    try:
-                        widget_index = widget_input_names.index(input_name)
-                        if widget_index < len(filtered_widget_values):
-                            inputs[input_name] = filtered_widget_values[widget_index]
-                        else:
-                            logger.warning(f"节点 {node_id} 的输入 {input_name} 没有对应的widget值（过滤后）")
-                    except ValueError as e:
-                        logger.warning(f"节点 {node_id} 的输入 {input_name} 不在widget输入列表中: {e}")
-        
-        # 构建_meta信息
-        _meta = {}
-        if node_title:
-            _meta["title"] = node_title
-        if node_order is not None:  # 仅当order存在时添加，避免多余的None值
-            _meta["order"] = node_order
-        
         # 暂存localized_names和types
         inputs["_localized_names"] = localized_names
         inputs["_types"] = types
-        
+
         # 添加节点到构建器
-        builder.node(class_type, id=node_id, _meta=_meta, **inputs)
+        builder.node(node["type"], id=node_id, _meta=get_node_meta(node), **inputs)
 
     # 第三步：调整_meta等字段位置
     finalized = builder.finalize()
@@ -210,29 +1004,655 @@ def convert_workflow_format(original_workflow):
     return finalized
 
 
+def extract_workflow_parameters(original_workflow):
+    """
+    参数视图：只提取插件面板需要的标题、order、localized_names、types和widget值，按order排序
+    不建立link索引、不解析上游源、也不经过GraphBuilder
+    """
+    parameters = []
+    seen_node_ids = set()
+    for node in original_workflow.get("nodes", []):
+        node_id = str(node["id"])
+        # 与完整转换一致：重复的节点ID只保留第一个
+        if node_id in seen_node_ids or WorkflowGraph.is_ignored_node(node):
+            continue
+        seen_node_ids.add(node_id)
+        inputs, localized_names, types = extract_node_inputs(node_id, node)
+        parameters.append({
+            "id": node_id,
+            "class_type": node["type"],
+            "_meta": get_node_meta(node),
+            "inputs": inputs,
+            "localized_names": localized_names,
+            "types": types,
+        })
+    # 没有order的节点排在最后，order相同时保持原顺序
+    parameters.sort(key=lambda item: (item["_meta"].get("order") is None, item["_meta"].get("order") or 0))
+    return parameters
+
+
+# 工作流视图：full 为可提交执行的完整图，params 只包含面板参数
+WORKFLOW_VIEWS = {"full": convert_workflow_format, "params": extract_workflow_parameters}
+# 各视图需要从工作流文件中读取的顶层数组
+WORKFLOW_VIEW_KEYS = {"full": ("nodes", "links"), "params": ("nodes",)}
+
+
+# 预编译模式：转换结果以序列化JSON持久化到工作流目录下的隐藏目录，按源文件内容哈希校验
+PRECOMPILE_ENABLED = get_env_bool("PS_COMFY_TIHEAVEN_PRECOMPILE")
+PRECOMPILE_DIR = os.path.join(WORKFLOW_DIR, ".ps-comfy-tiheaven-compiled")
+# 转换逻辑变化时递增，使旧的预编译文件失效
+CONVERTER_VERSION = 1
+
+
+def get_precompiled_path(filepath):
+    """预编译文件路径：按工作流相对路径镜像到隐藏目录，扩展名不是.json以免被当作工作流列出"""
+    rel_path = os.path.relpath(filepath, WORKFLOW_DIR)
+    return os.path.join(PRECOMPILE_DIR, rel_path + ".compiled")
+
+
+def read_precompiled(filepath, source_hash):
+    """读取预编译结果，源文件哈希或转换器版本不一致时返回None"""
+    try:
+        with open(get_precompiled_path(filepath), "rb") as f:
+            header = f.readline()
+            body = f.read()
+        meta = json.loads(header)
+    except (OSError, ValueError):
+        return None
+    if meta.get("source_sha256") != source_hash or meta.get("converter_version") != CONVERTER_VERSION:
+        return None
+    return body
+
+
+def write_precompiled(filepath, source_hash, body):
+    """写入预编译结果：首行为校验信息，其后为序列化后的JSON"""
+    path = get_precompiled_path(filepath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = json.dumps({"source_sha256": source_hash, "converter_version": CONVERTER_VERSION})
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.encode("utf-8") + b"\n")
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+# 工作流大小上限：文件超过 MAX_WORKFLOW_BYTES，或流式解析时保留的nodes/links超过 MAX_WORKFLOW_MEMORY_BYTES 时拒绝转换（413）
+MAX_WORKFLOW_BYTES = get_env_int("PS_COMFY_TIHEAVEN_MAX_WORKFLOW_MB", 256) * 1024 * 1024
+MAX_WORKFLOW_MEMORY_BYTES = get_env_int("PS_COMFY_TIHEAVEN_MAX_WORKFLOW_MEMORY_MB", 64) * 1024 * 1024
+WORKFLOW_READ_CHUNK = 64 * 1024
+# 转换只用到节点的这些字段，其余字段（pos、size、flags等）解析后立即丢弃
+WORKFLOW_NODE_KEYS = ("id", "type", "mode", "inputs", "outputs", "title", "properties", "order", "widgets_values")
+
+
+class WorkflowTooLargeError(ValueError):
+    """工作流文件或解析时占用的内存超出上限"""
+
+
+class JsonStreamReader:
+    """
+    增量JSON读取器：按块读取文件，用 JSONDecoder.raw_decode 逐个解析值，缓冲区只保留尚未解析的部分
+    单个值跨越多个块时每次至少读入与缓冲区等量的内容，避免对超长字符串反复从头解析
+    """
+
+    def __init__(self, f, chunk_size=WORKFLOW_READ_CHUNK):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """读入更多内容，已到文件末尾时返回False"""
+        if self._eof:
+            return False
+        size = max(self._chunk_size, len(self._buffer) - self._pos)
+        chunk = self._file.read(size)
+        if not chunk:
+            self._eof = True
+        text = self._text_decoder.decode(chunk, final=self._eof)
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return bool(chunk)
+
+    def _error(self, message):
+        return json.JSONDecodeError(message, self._buffer, self._pos)
+
+    def peek(self):
+        """跳过空白并返回下一个字符，文件结束时返回空字符串"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\n\r":
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars):
+        """读取一个结构字符（必须是 chars 之一）并返回"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise self._error(f"期望 {' 或 '.join(chars)}")
+        self._pos += 1
+        return char
+
+    def read_value(self):
+        """解析下一个完整的JSON值，返回 (值, 占用的字符数)"""
+        self.peek()
+        while True:
+            start = self._pos
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, start)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # 数字可能被块边界截断（如 "-1.5e" 被解析为 -1.5），其后直到缓冲区末尾都是数字字符时读入更多内容重新解析
+            if (
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                and not self._buffer[end:].strip("0123456789+-.eE") and self._fill()
+            ):
+                continue
+            self._pos = end
+            return value, end - start
+
+
+def iter_workflow_items(filepath, keys=("nodes", "links")):
+    """
+    流式遍历工作流文件顶层 keys 数组中的元素，逐个产出 (字段名, 元素, 元素字符数)
+    其它顶层字段（extra、groups等）解析后立即丢弃，整个文件不会同时驻留在内存中
+    """
+    with open(filepath, "rb") as f:
+        reader = JsonStreamReader(f)
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            key, _ = reader.read_value()
+            if not isinstance(key, str):
+                raise reader._error("期望字段名")
+            reader.expect(":")
+            if key in keys and reader.peek() == "[":
+                reader.expect("[")
+                if reader.peek() == "]":
+                    reader.expect("]")
+                else:
+                    while True:
+                        item, size = reader.read_value()
+                        yield key, item, size
+                        del item
+                        if reader.expect(",]") == "]":
+                            break
+            else:
+                reader.read_value()
+            if reader.expect(",}") == "}":
+                return
+
+
+def load_workflow_streaming(filepath, max_memory_bytes=None, keys=("nodes", "links")):
+    """
+    流式加载转换需要的顶层数组（默认 nodes 和 links，节点只保留 WORKFLOW_NODE_KEYS 中的字段），未列出的字段直接跳过
+    文件大小或保留内容超过上限时抛出 WorkflowTooLargeError
+    """
+    max_memory_bytes = MAX_WORKFLOW_MEMORY_BYTES if max_memory_bytes is None else max_memory_bytes
+    if MAX_WORKFLOW_BYTES and os.path.getsize(filepath) > MAX_WORKFLOW_BYTES:
+        raise WorkflowTooLargeError(f"工作流文件超过 {MAX_WORKFLOW_BYTES // (1024 * 1024)}MB 上限")
+
+    workflow = {key: [] for key in keys}
+    retained = 0
+    for key, item, size in iter_workflow_items(filepath, keys):
+        if key == "nodes" and isinstance(item, dict):
+            item = {name: item[name] for name in WORKFLOW_NODE_KEYS if name in item}
+        retained += size
+        if max_memory_bytes and retained > max_memory_bytes:
+            raise WorkflowTooLargeError(f"工作流解析内容超过 {max_memory_bytes // (1024 * 1024)}MB 上限")
+        workflow[key].append(item)
+    return workflow
+
+
+def hash_file(filepath):
+    """按块计算文件的sha256，不把整个文件读入内存"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(WORKFLOW_READ_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def convert_workflow(workflow, view="full"):
+    """按视图转换已加载的工作流，并按节点数/连接数区间记录转换耗时"""
+    started_at = metric_clock()
+    converted = WORKFLOW_VIEWS[view](workflow)
+    observe_since("ps_comfy_tiheaven_convert_duration_seconds", started_at, (
+        ("view", view),
+        ("nodes", size_class(len(workflow.get("nodes", [])))),
+        ("links", size_class(len(workflow.get("links", [])))),
+    ))
+    return converted
+
+
+def convert_workflow_file(filepath, view="full"):
+    """流式读取工作流文件并按视图转换，返回序列化后的JSON字节（可在线程池或预编译命令行的进程池中执行）"""
+    if view != "full":
+        # 参数视图计算量很小，不做预编译持久化；只读取该视图需要的字段（参数视图不需要links）
+        workflow = load_workflow_streaming(filepath, keys=WORKFLOW_VIEW_KEYS[view])
+        return json.dumps(convert_workflow(workflow, view)).encode("utf-8")
+
+    source_hash = None
+    if PRECOMPILE_ENABLED:
+        source_hash = hash_file(filepath)
+        body = read_precompiled(filepath, source_hash)
+        if body is not None:
+            return body
+
+    # 转换工作流格式；原始结构只在转换期间存在，序列化前即可释放
+    converted_workflow = convert_workflow(load_workflow_streaming(filepath))
+    body = json.dumps(converted_workflow).encode("utf-8")
+    del converted_workflow
+
+    if PRECOMPILE_ENABLED:
+        try:
+            write_precompiled(filepath, source_hash, body)
+        except OSError as e:
+            logger.warning(f"写入预编译工作流失败: {str(e)}")
+    return body
+
+
+def cache_converted_workflow(cache_key, body):
+    """将序列化后的转换结果放入内存缓存并返回缓存条目"""
+    # 压缩版本按需生成后存入 encodings，与未压缩的响应体一起缓存
+    cached = CachedResponse(body=body, etag=make_etag(body), last_modified=cache_key[1] / 1e9, encodings={})
+    WORKFLOW_CACHE.put(cache_key, cached, len(body))
+    return cached
+
+
+# 按请求的性能分析：开启后请求带 profile=1 查询参数或 PROFILE_HEADER 头时，跳过缓存并用cProfile记录转换/缩略图生成
+PROFILE_ENABLED = get_env_bool("PS_COMFY_TIHEAVEN_PROFILE")
+PROFILE_HEADER = "X-Ps-Comfy-TiHeaveN-Profile"
+# cProfile在同一进程内不能同时运行多个分析器（Python 3.12起会直接报错），分析串行执行
+PROFILE_LOCK = threading.Lock()
+
+
+class ProfileStore:
+    """性能分析结果的环形目录：文件名以时间戳开头，超过 max_files 个时删除最旧的"""
+
+    def __init__(self, profile_dir, max_files):
+        self.profile_dir = profile_dir
+        self.max_files = max_files
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def save(self, label, stats_data):
+        """写入一份marshal序列化的pstats数据并返回文件名"""
+        safe_label = re.sub(r"[^\w.-]+", "_", label)[:80]
+        with self._lock:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            self._counter += 1
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self._counter:04d}-{safe_label}.prof"
+            with open(os.path.join(self.profile_dir, name), "wb") as f:
+                f.write(stats_data)
+            for old_name in self.list_names()[self.max_files:]:
+                try:
+                    os.remove(os.path.join(self.profile_dir, old_name))
+                except OSError:
+                    pass
+        return name
+
+    def list_names(self):
+        """按时间从新到旧返回所有分析文件名"""
+        try:
+            names = [name for name in os.listdir(self.profile_dir) if name.endswith(".prof")]
+        except OSError:
+            return []
+        return sorted(names, reverse=True)
+
+    def list_profiles(self):
+        profiles = []
+        for name in self.list_names():
+            try:
+                stat = os.stat(os.path.join(self.profile_dir, name))
+            except OSError:
+                continue
+            profiles.append({"name": name, "size": stat.st_size, "created": stat.st_mtime})
+        return profiles
+
+    def read(self, name):
+        """读取分析文件，文件名不在列表中（含路径穿越）时返回None"""
+        if name not in self.list_names():
+            return None
+        with open(os.path.join(self.profile_dir, name), "rb") as f:
+            return f.read()
+
+
+_profile_store = None
+
+
+def get_profile_store():
+    """获取性能分析结果目录（位于input目录旁，首次使用时创建）"""
+    global _profile_store
+    if _profile_store is None:
+        _profile_store = ProfileStore(
+            os.path.join(os.path.dirname(get_input_dir()), "ps-comfy-tiheaven-profiles"),
+            get_env_int("PS_COMFY_TIHEAVEN_PROFILE_KEEP", 20),
+        )
+    return _profile_store
+
+
+def profile_call(func, *args):
+    """用cProfile运行函数，返回 (结果, marshal序列化的pstats数据)（在执行器线程中运行）"""
+    import cProfile
+    import marshal
+
+    with PROFILE_LOCK:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func, *args)
+        profiler.create_stats()
+        return result, marshal.dumps(profiler.stats)
+
+
+class ProfileCapture:
+    """单个请求的性能分析：在执行器中用cProfile运行阻塞函数，结果写入环形目录后 name 为文件名"""
+
+    def __init__(self, label):
+        self.label = label
+        self.name = None
+
+    async def run(self, func, *args, cpu_bound=False):
+        result, stats_data = await EXECUTOR.run(profile_call, func, *args, cpu_bound=cpu_bound)
+        self.name = await EXECUTOR.run(get_profile_store().save, self.label, stats_data)
+        return result
+
+    def annotate(self, response):
+        """在响应头中返回分析文件名，便于从列表路由下载"""
+        if self.name is not None:
+            response.headers[PROFILE_HEADER] = self.name
+        return response
+
+
+def start_profile(request, label):
+    """已开启性能分析且请求要求分析时返回 ProfileCapture，否则返回None"""
+    if not PROFILE_ENABLED:
+        return None
+    if parse_bool_param(request.query.get("profile", "")) or parse_bool_param(request.headers.get(PROFILE_HEADER, "")):
+        return ProfileCapture(label)
+    return None
+
+
+async def load_converted_workflow(filepath, view="full", profile=None):
+    """
+    读取并按视图转换工作流，返回缓存的序列化结果；文件修改时间或大小变化后自动重新转换
+    并发的相同请求合并为一次转换；传入 profile 时跳过内存缓存和合并，在分析器下重新转换
+    """
+    cache_key = await EXECUTOR.run(get_file_signature, filepath)
+    if view != "full":
+        cache_key += (view,)
+    if profile is not None:
+        body = await profile.run(convert_workflow_file, filepath, view, cpu_bound=True)
+        return cache_converted_workflow(cache_key, body)
+
+    cached = WORKFLOW_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    async def convert():
+        body = await EXECUTOR.run(convert_workflow_file, filepath, view, cpu_bound=True)
+        return cache_converted_workflow(cache_key, body)
+
+    # 多个客户端同时打开同一工作流时只转换一次
+    return await SINGLE_FLIGHT.run("workflow", cache_key, convert)
+
+
+def iter_workflow_files():
+    """遍历 WORKFLOW_DIR 下所有工作流文件（跳过隐藏目录）"""
+    for root, dirnames, filenames in os.walk(WORKFLOW_DIR):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+        for name in filenames:
+            if name.endswith(".json"):
+                yield os.path.join(root, name)
+
+
+def precompile_workflows(max_workers=None, use_processes=False):
+    """
+    并行预编译 WORKFLOW_DIR 下的所有工作流并填充内存缓存，返回 (成功数, 失败数)
+    默认使用线程池：在运行中的ComfyUI进程里fork会把其它线程持有的锁（如logging）复制到子进程导致死锁；
+    use_processes=True 只应在单线程的命令行进程（precompile.py）中使用，不支持fork时退回线程池
+    """
+    max_workers = max_workers or get_env_int("PS_COMFY_TIHEAVEN_PRECOMPILE_WORKERS", os.cpu_count() or 1)
+    pool = (create_process_pool(max_workers) if use_processes else None) or ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="ps-comfy-tiheaven-precompile"
+    )
+    succeeded = failed = 0
+    with pool:
+        futures = {}
+        for filepath in iter_workflow_files():
+            try:
+                futures[pool.submit(convert_workflow_file, filepath)] = get_file_signature(filepath)
+            except OSError:
+                failed += 1
+        for future, cache_key in futures.items():
+            try:
+                cache_converted_workflow(cache_key, future.result())
+                succeeded += 1
+            except Exception as e:
+                logger.warning(f"预编译工作流失败: {cache_key[0]}: {str(e)}")
+                failed += 1
+    return succeeded, failed
+
+
+def start_precompile_warmup():
+    """预编译模式开启时，在后台线程中预热所有工作流，使重启后的首次加载无需转换"""
+    if not PRECOMPILE_ENABLED:
+        return
+
+    def warmup():
+        started_at = time.perf_counter()
+        succeeded, failed = precompile_workflows()
+        logger.info(
+            f"[Ps-Comfy-TiHeaveN]: 工作流预编译完成：成功 {succeeded} 个，失败 {failed} 个，"
+            f"耗时 {time.perf_counter() - started_at:.2f}s"
+        )
+
+    threading.Thread(target=warmup, name="ps-comfy-tiheaven-precompile", daemon=True).start()
+
+
+# 增量同步（RFC 3229）：保留每个工作流最近几个转换版本，客户端声明已有版本时返回 JSON Patch（RFC 6902）
+WORKFLOW_DELTA_HISTORY = get_env_int("PS_COMFY_TIHEAVEN_DELTA_HISTORY", 4)
+WORKFLOW_DELTA_CONTENT_TYPE = "application/json-patch+json"
+
+
+class WorkflowHistory:
+    """按工作流和视图保留最近若干个转换版本（ETag -> 序列化JSON），总字节数超限时先淘汰最久未访问条目的旧版本"""
+
+    def __init__(self, max_versions, max_bytes):
+        self.max_versions = max_versions
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (文件路径, 视图) -> OrderedDict(ETag -> 响应体)
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, key, etag, body):
+        if self.max_versions <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            versions = self._entries.setdefault(key, OrderedDict())
+            self._entries.move_to_end(key)
+            if etag in versions:
+                versions.move_to_end(etag)
+                return
+            versions[etag] = body
+            self._current_bytes += len(body)
+            while len(versions) > self.max_versions:
+                _, old_body = versions.popitem(last=False)
+                self._current_bytes -= len(old_body)
+            while self._current_bytes > self.max_bytes:
+                oldest_key, oldest_versions = next(iter(self._entries.items()))
+                _, old_body = oldest_versions.popitem(last=False)
+                self._current_bytes -= len(old_body)
+                if not oldest_versions:
+                    del self._entries[oldest_key]
+
+    def get(self, key, etag):
+        with self._lock:
+            versions = self._entries.get(key)
+            return None if versions is None else versions.get(etag)
+
+    @property
+    def current_bytes(self):
+        return self._current_bytes
+
+
+# 历史版本通常与 WORKFLOW_CACHE 共享同一份字节对象，这里只限制额外占用的上限
+WORKFLOW_HISTORY = WorkflowHistory(
+    WORKFLOW_DELTA_HISTORY, get_env_int("PS_COMFY_TIHEAVEN_DELTA_HISTORY_MB", 32) * 1024 * 1024
+)
+# (基准ETag, 当前ETag) -> 补丁的缓存条目；补丁不划算时缓存False，避免重复计算
+WORKFLOW_PATCH_CACHE = LRUCache(8 * 1024 * 1024)
+
+
+def escape_json_pointer(token):
+    """按RFC 6901转义JSON Pointer中的路径片段"""
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def diff_json(old, new, path="", ops=None):
+    """生成把 old 变为 new 的 JSON Patch 操作列表（RFC 6902）"""
+    if ops is None:
+        ops = []
+    if type(old) is not type(new):
+        ops.append({"op": "replace", "path": path, "value": new})
+    elif isinstance(new, dict):
+        for key, value in old.items():
+            child_path = f"{path}/{escape_json_pointer(key)}"
+            if key in new:
+                diff_json(value, new[key], child_path, ops)
+            else:
+                ops.append({"op": "remove", "path": child_path})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": f"{path}/{escape_json_pointer(key)}", "value": value})
+    elif isinstance(new, list):
+        common = min(len(old), len(new))
+        for index in range(common):
+            diff_json(old[index], new[index], f"{path}/{index}", ops)
+        # 从末尾往前删除多余元素，保证每一步的下标都有效
+        for index in range(len(old) - 1, common - 1, -1):
+            ops.append({"op": "remove", "path": f"{path}/{index}"})
+        for value in new[common:]:
+            ops.append({"op": "add", "path": f"{path}/-", "value": value})
+    elif old != new:
+        ops.append({"op": "replace", "path": path, "value": new})
+    return ops
+
+
+def build_workflow_patch(base_body, body):
+    """计算两个转换版本之间的JSON Patch，补丁不比完整内容小时返回None（在执行器线程中运行）"""
+    ops = diff_json(json.loads(base_body), json.loads(body))
+    patch = json.dumps(ops).encode("utf-8")
+    return patch if len(patch) < len(body) else None
+
+
+def accepts_json_patch(request):
+    """请求的A-IM头是否声明接受json-patch增量"""
+    return any(
+        token.split(";")[0].strip().lower() == "json-patch"
+        for token in request.headers.get("A-IM", "").split(",")
+    )
+
+
+def parse_delta_bases(request):
+    """从If-None-Match中取出客户端已有版本的ETag（去掉W/前缀和压缩编码后缀）"""
+    bases = []
+    for tag in request.headers.get("If-None-Match", "").split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        for encoding in ENCODING_PREFERENCE:
+            suffix = f'-{encoding}"'
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)] + '"'
+                break
+        if tag:
+            bases.append(tag)
+    return bases
+
+
+async def make_workflow_delta_response(request, history_key, cached):
+    """
+    客户端已有的版本在历史中时返回226和JSON Patch，已是当前版本时返回304（不区分压缩编码）；
+    历史中找不到或补丁比完整内容大时返回None，由调用方返回完整内容
+    """
+    bases = parse_delta_bases(request)
+    if cached.etag in bases:
+        return web.Response(
+            status=304, headers={"ETag": cached.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding, A-IM"}
+        )
+    for base in bases:
+        base_body = WORKFLOW_HISTORY.get(history_key, base)
+        if base_body is None:
+            continue
+        patch_key = (base, cached.etag)
+        patch_entry = WORKFLOW_PATCH_CACHE.get(patch_key)
+        if patch_entry is None:
+            patch = await EXECUTOR.run(build_workflow_patch, base_body, cached.body, cpu_bound=True)
+            # 补丁的ETag是应用补丁后得到的当前版本的ETag
+            patch_entry = False if patch is None else CachedResponse(
+                body=patch, etag=cached.etag, last_modified=cached.last_modified, encodings={}
+            )
+            WORKFLOW_PATCH_CACHE.put(patch_key, patch_entry, 0 if patch is None else len(patch))
+        if patch_entry is False:
+            return None
+        await ensure_encoding(request, patch_entry)
+        return make_cached_response(
+            request, patch_entry, WORKFLOW_DELTA_CONTENT_TYPE, charset="utf-8", status=226,
+            headers={"IM": "json-patch", "Delta-Base": base, "Vary": "Accept-Encoding, A-IM"},
+        )
+    return None
+
+
 async def handle_get_workflow(request):
-    """处理获取单个工作流文件的请求（/workflows/{filename}）"""
+    """
+    处理获取单个工作流文件的请求（/workflows/{filename}）
+    可选查询参数：view=params 只返回面板参数（按order排序），默认 view=full 返回可提交执行的完整图
+    请求带 A-IM: json-patch 且 If-None-Match 为历史版本的ETag时，返回相对该版本的 JSON Patch
+    开启性能分析时，profile=1 会在分析器下重新转换，分析文件名通过响应头返回
+    """
     filename = request.match_info.get("filename")
     if not filename or not filename.endswith(".json"):
         return web.Response(status=400, text="无效的文件名（必须是 .json 文件）")
 
+    view = request.query.get("view", "full")
+    if view not in WORKFLOW_VIEWS:
+        return web.Response(status=400, text=f"无效的视图（可选：{', '.join(WORKFLOW_VIEWS)}）")
+
     # 构建文件路径并验证安全性（防止目录遍历攻击）
     filepath = os.path.abspath(os.path.join(WORKFLOW_DIR, filename))
     if os.path.commonpath((WORKFLOW_DIR, filepath)) != WORKFLOW_DIR:
         return web.Response(status=403, text="访问被拒绝：无效路径")
 
     # 读取并返回工作流内容
-    if not os.path.isfile(filepath):
+    if not await EXECUTOR.run(os.path.isfile, filepath):
         return web.Response(status=404, text="工作流文件不存在")
 
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            original_workflow = json.load(f)
-        
-        # 转换工作流格式
-        converted_workflow = convert_workflow_format(original_workflow)
-        
-        return web.json_response(converted_workflow)
+        profile = start_profile(request, f"workflow-{view}-{filename}")
+        cached = await load_converted_workflow(filepath, view, profile)
+        # 不同视图各自保留历史版本
+        history_key = (filepath, view)
+        WORKFLOW_HISTORY.record(history_key, cached.etag, cached.body)
+        response = None
+        if accepts_json_patch(request):
+            response = await make_workflow_delta_response(request, history_key, cached)
+        if response is None:
+            await ensure_encoding(request, cached)
+            response = make_cached_response(
+                request, cached, "application/json", charset="utf-8", headers={"Vary": "Accept-Encoding, A-IM"}
+            )
+        return profile.annotate(response) if profile is not None else response
+    except ClientLimitExceeded:
+        return make_too_many_requests_response()
+    except WorkflowTooLargeError as e:
+        return web.Response(status=413, text=str(e))
     except json.JSONDecodeError:
         return web.Response(status=500, text="工作流文件 JSON 格式无效")
     except Exception as e:
@@ -240,8 +1660,256 @@ async def handle_get_workflow(request):
         return web.Response(status=500, text="读取工作流文件时发生错误")
 
 
+def read_workflow_metadata(filepath):
+    """解析工作流文件的元数据：节点数量、是否包含标题为main的LoadImage节点（主图）"""
+    node_count = 0
+    has_main_image = False
+    try:
+        if MAX_WORKFLOW_BYTES and os.path.getsize(filepath) > MAX_WORKFLOW_BYTES:
+            raise WorkflowTooLargeError(filepath)
+        # 流式遍历节点，不保留任何节点内容
+        for _, node, _ in iter_workflow_items(filepath, keys=("nodes",)):
+            node_count += 1
+            if isinstance(node, dict) and node.get("type") == "LoadImage" and node.get("title") == "main":
+                has_main_image = True
+    except (OSError, ValueError):
+        return {"node_count": None, "has_main_image": False}
+    return {"node_count": node_count, "has_main_image": has_main_image}
+
+
+class WorkflowCatalog:
+    """
+    工作流目录索引：后台线程定期按修改时间增量刷新，只重新解析发生变化的文件
+    列表请求直接读取索引；目录本身的修改时间变化（增删文件）时会立即重扫该目录
+    """
+
+    def __init__(self, root, interval):
+        self.root = root
+        self.interval = interval
+        # 相对路径（"/"分隔，根目录为""）-> {"mtime_ns", "files": {文件名: 条目}, "subdirs": [子目录名]}
+        self._dirs = {}
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._digest = None  # 索引内容摘要，索引变化时置空、按需重新计算
+        self._listeners = []  # 索引发生变化时以变化列表调用
+        self._loaded = threading.Event()  # 从根目录完成过一次完整遍历
+
+    def _to_abs(self, rel_dir):
+        return os.path.join(self.root, *rel_dir.split("/")) if rel_dir else self.root
+
+    def add_listener(self, callback):
+        """注册变化回调：任何一次扫描（后台刷新或列表请求触发）发现变化时调用 callback(changes)"""
+        self._listeners.append(callback)
+
+    def scan_dir(self, rel_dir, only_if_changed=False):
+        """扫描单层目录并更新索引，返回变化列表 [(类型, 相对路径)]，类型为 added/modified/removed"""
+        changes = self._scan_dir(rel_dir, only_if_changed)
+        if changes:
+            for callback in self._listeners:
+                try:
+                    callback(changes)
+                except Exception as e:
+                    logger.error(f"工作流索引变化回调失败: {str(e)}")
+        return changes
+
+    def _scan_dir(self, rel_dir, only_if_changed):
+        abs_dir = self._to_abs(rel_dir)
+        try:
+            dir_mtime_ns = os.stat(abs_dir).st_mtime_ns
+        except OSError:
+            return self._remove_dir(rel_dir)
+
+        with self._lock:
+            old_state = self._dirs.get(rel_dir)
+            if only_if_changed and old_state is not None and old_state["mtime_ns"] == dir_mtime_ns:
+                return []
+            old_files = old_state["files"] if old_state else {}
+
+            files = {}
+            subdirs = []
+            changes = []
+            for entry in os.scandir(abs_dir):
+                if entry.is_file():
+                    # 仅保留 JSON 文件
+                    if not entry.name.endswith(".json"):
+                        continue
+                    stat = entry.stat()
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    old_entry = old_files.get(entry.name)
+                    if (old_entry is not None and old_entry["_mtime_ns"] == stat.st_mtime_ns
+                            and old_entry["size"] == stat.st_size):
+                        files[entry.name] = old_entry
+                        continue
+                    files[entry.name] = {
+                        "name": entry.name,
+                        "path": rel_path,  # 相对路径（用于客户端构建文件 URL）
+                        "size": stat.st_size,  # 文件大小（字节）
+                        "modified": stat.st_mtime,  # 最后修改时间（时间戳）
+                        "_mtime_ns": stat.st_mtime_ns,
+                        **read_workflow_metadata(entry.path)
+                    }
+                    changes.append(("modified" if old_entry is not None else "added", rel_path))
+                elif entry.is_dir() and not entry.name.startswith("."):
+                    # 跳过隐藏目录（如预编译缓存目录）
+                    subdirs.append(entry.name)
+
+            for name, old_entry in old_files.items():
+                if name not in files:
+                    changes.append(("removed", old_entry["path"]))
+            for name in (old_state["subdirs"] if old_state else []):
+                if name not in subdirs:
+                    changes.extend(self._remove_dir(f"{rel_dir}/{name}" if rel_dir else name))
+
+            subdirs.sort()
+            if changes or old_state is None or old_state["subdirs"] != subdirs:
+                self._digest = None
+            self._dirs[rel_dir] = {"mtime_ns": dir_mtime_ns, "files": files, "subdirs": subdirs}
+            return changes
+
+    def _remove_dir(self, rel_dir):
+        """从索引中移除目录及其所有子目录，返回被移除文件的变化列表"""
+        changes = []
+        with self._lock:
+            prefix = rel_dir + "/"
+            for key in [key for key in self._dirs if key == rel_dir or key.startswith(prefix)]:
+                state = self._dirs.pop(key)
+                changes.extend(("removed", entry["path"]) for entry in state["files"].values())
+                self._digest = None
+        return changes
+
+    def refresh(self, root_dir="", only_if_changed=False):
+        """
+        从 root_dir（默认根目录）开始完整遍历，返回变化列表
+        only_if_changed=True 时只重扫修改时间变化或尚未建立索引的目录
+        """
+        changes = []
+        pending = [root_dir]
+        while pending:
+            rel_dir = pending.pop()
+            try:
+                changes.extend(self.scan_dir(rel_dir, only_if_changed))
+            except OSError as e:
+                logger.warning(f"扫描工作流目录失败: {rel_dir}: {str(e)}")
+                continue
+            with self._lock:
+                state = self._dirs.get(rel_dir)
+                if state is not None:
+                    pending.extend(f"{rel_dir}/{name}" if rel_dir else name for name in state["subdirs"])
+        if not root_dir:
+            self._loaded.set()
+        return changes
+
+    def ensure_loaded(self):
+        """尚未完成过完整遍历时同步扫描一次（后台线程的首轮可能只扫了一部分目录）"""
+        if not self._loaded.is_set():
+            self.refresh()
+
+    def get_digest(self):
+        """返回索引摘要（目录结构与各文件的路径、大小、修改时间），任何工作流增删改都会使其变化"""
+        with self._lock:
+            if self._digest is None:
+                hasher = hashlib.sha256()
+                for rel_dir in sorted(self._dirs):
+                    state = self._dirs[rel_dir]
+                    hasher.update(f"D|{rel_dir}\n".encode("utf-8"))
+                    for name, entry in sorted(state["files"].items()):
+                        hasher.update(f"F|{entry['path']}|{entry['size']}|{entry['_mtime_ns']}\n".encode("utf-8"))
+                self._digest = hasher.hexdigest()[:32]
+            return self._digest
+
+    def get_file_count(self):
+        with self._lock:
+            return sum(len(state["files"]) for state in self._dirs.values())
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"刷新工作流索引失败: {str(e)}")
+            if self._stop_event.wait(self.interval):
+                break
+
+    def start(self):
+        """启动后台刷新线程（重复调用无副作用）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ps-comfy-tiheaven-catalog", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def list_directory(self, rel_dir, recursive=False, query=None, offset=0, limit=None):
+        """
+        返回目录列表：recursive=True时包含所有子目录中的文件，query按文件名/路径不区分大小写过滤
+        offset/limit对文件列表分页，total为分页前的文件总数；目录不存在（或不是目录）时返回None
+        """
+        if not os.path.isdir(self._to_abs(rel_dir)):
+            return None
+        # 请求的目录有增删时立即重扫，保证列表与磁盘一致；递归列表还要补扫尚未建立索引或有变化的子目录
+        if recursive:
+            self.refresh(rel_dir, only_if_changed=True)
+        else:
+            self.scan_dir(rel_dir, only_if_changed=True)
+        with self._lock:
+            state = self._dirs.get(rel_dir)
+            if state is None:
+                return None
+
+            states = [state]
+            if recursive:
+                prefix = rel_dir + "/" if rel_dir else ""
+                states = [
+                    self._dirs[key] for key in sorted(self._dirs)
+                    if key == rel_dir or key.startswith(prefix)
+                ]
+            files = [
+                {key: value for key, value in entry.items() if not key.startswith("_")}
+                for dir_state in states
+                for _, entry in sorted(dir_state["files"].items())
+            ]
+            directories = [
+                {
+                    "name": name,
+                    "path": f"{rel_dir}/{name}" if rel_dir else name  # 相对路径（用于客户端构建子目录 URL）
+                }
+                for name in state["subdirs"]
+            ]
+
+        if query:
+            query = query.lower()
+            files = [entry for entry in files if query in entry["path"].lower()]
+        total = len(files)
+        files = files[offset:offset + limit] if limit is not None else files[offset:]
+
+        return {
+            "directory": rel_dir or ".",
+            "files": files,
+            "directories": directories,
+            "total": total,
+            "offset": offset
+        }
+
+
+# 工作流目录索引，后台刷新间隔可通过环境变量调整（秒）
+WORKFLOW_CATALOG = WorkflowCatalog(WORKFLOW_DIR, get_env_int("PS_COMFY_TIHEAVEN_CATALOG_INTERVAL", 10))
+
+
+def parse_bool_param(value):
+    """解析查询参数中的布尔值"""
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+# 目录列表响应缓存（按内容ETag），保留已生成的压缩版本
+LISTING_CACHE = LRUCache(8 * 1024 * 1024)
+
+
 async def list_workflows(request):
-    """处理目录列表请求（/workflows/ 或 /workflows/subdir/）"""
+    """
+    处理目录列表请求（/workflows/ 或 /workflows/subdir/）
+    可选查询参数：recursive=1 递归列出子目录文件，q=关键字 按名称搜索，offset/limit 分页
+    """
     subpath = request.match_info.get("subpath", "")
     # 构建目标目录路径
     target_dir = os.path.abspath(os.path.join(WORKFLOW_DIR, subpath))
@@ -250,39 +1918,37 @@ async def list_workflows(request):
     if os.path.commonpath((WORKFLOW_DIR, target_dir)) != WORKFLOW_DIR:
         return web.Response(status=403, text="访问被拒绝：无效路径")
 
-    # 检查目录是否存在
-    if not os.path.isdir(target_dir):
-        return web.Response(status=404, text="目录不存在")
+    try:
+        offset = int(request.query.get("offset", 0))
+        limit = int(request.query["limit"]) if "limit" in request.query else None
+    except ValueError:
+        return web.Response(status=400, text="offset/limit 必须是整数")
+    if offset < 0 or (limit is not None and limit < 0):
+        return web.Response(status=400, text="offset/limit 不能为负数")
 
-    files = []
-    directories = []
+    rel_dir = os.path.relpath(target_dir, WORKFLOW_DIR).replace(os.sep, "/")
+    if rel_dir == ".":
+        rel_dir = ""
 
     try:
-        # 遍历目录内容
-        for entry in os.scandir(target_dir):
-            if entry.is_file():
-                # 仅保留 JSON 文件
-                if entry.name.endswith(".json"):
-                    stat = entry.stat()
-                    files.append({
-                        "name": entry.name,
-                        "size": stat.st_size,  # 文件大小（字节）
-                        "modified": stat.st_mtime  # 最后修改时间（时间戳）
-                    })
-            elif entry.is_dir():
-                # 收集子目录信息
-                rel_path = os.path.relpath(entry.path, WORKFLOW_DIR).replace(os.sep, "/")
-                directories.append({
-                    "name": entry.name,
-                    "path": rel_path  # 相对路径（用于客户端构建子目录 URL）
-                })
-
+        WORKFLOW_CATALOG.start()
         # 返回结构化目录信息
-        return web.json_response({
-            "directory": os.path.relpath(target_dir, WORKFLOW_DIR).replace(os.sep, "/"),
-            "files": files,
-            "directories": directories
-        })
+        listing = await EXECUTOR.run(
+            WORKFLOW_CATALOG.list_directory, rel_dir,
+            parse_bool_param(request.query.get("recursive", "")),
+            request.query.get("q"), offset, limit
+        )
+        if listing is None:
+            return web.Response(status=404, text="目录不存在")
+        body = json.dumps(listing).encode("utf-8")
+        etag = make_etag(body)
+        # 内容未变时复用之前的缓存条目及其压缩版本，不必每次重新压缩
+        cached = LISTING_CACHE.get(etag)
+        if cached is None:
+            cached = CachedResponse(body=body, etag=etag, last_modified=None, encodings={})
+            LISTING_CACHE.put(etag, cached, len(body) * 2)  # 压缩版本按不超过原文大小计入
+        await ensure_encoding(request, cached)
+        return make_cached_response(request, cached, "application/json", charset="utf-8")
     except Exception as e:
         logger.error(f"列出工作流失败: {str(e)}")
         return web.Response(status=500, text="列出工作流时发生错误")
@@ -292,30 +1958,117 @@ def get_locales_dir():
     """获取 locales 目录路径"""
     # 基于当前文件路径定位 locales 目录
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    locales_dir = os.path.join(current_dir, "locales")
-    os.makedirs(locales_dir, exist_ok=True)  # 确保目录存在
-    return locales_dir
+    return os.path.join(current_dir, "locales")
+
+
+class LocaleStore:
+    """
+    语言包内存存储：首次请求时加载并校验所有语言文件，预先计算gzip/brotli压缩版本
+    请求时最多每隔 check_interval 秒检查一次文件修改时间，有变化才重新加载
+    """
+
+    def __init__(self, locales_dir, check_interval=2.0):
+        self.locales_dir = locales_dir
+        self.check_interval = check_interval
+        self._signature = None
+        self._checked_at = 0.0
+        self._files = {}  # 文件名 -> CachedResponse（仅包含校验通过的语言包）
+        self._invalid = set()  # JSON格式无效的文件名
+        self._listing = []
+        self._bundles = {}  # 语言代码元组 -> CachedResponse
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        """返回目录中所有 .json 文件的 (文件名, 修改时间ns, 大小, 修改时间)"""
+        os.makedirs(self.locales_dir, exist_ok=True)  # 确保目录存在
+        return tuple(sorted(
+            (entry.name, stat.st_mtime_ns, stat.st_size, stat.st_mtime)
+            for entry in os.scandir(self.locales_dir)
+            if entry.is_file() and entry.name.endswith(".json")
+            for stat in (entry.stat(),)
+        ))
+
+    def _load(self, signature):
+        files = {}
+        invalid = set()
+        for name, mtime_ns, _, _ in signature:
+            with open(os.path.join(self.locales_dir, name), "rb") as f:
+                body = f.read()
+            try:
+                if not isinstance(json.loads(body.decode("utf-8")), dict):
+                    raise ValueError("根节点必须是对象")
+            except ValueError as e:
+                logger.warning(f"语言文件 {name} 格式无效，已跳过: {str(e)}")
+                invalid.add(name)
+                continue
+            files[name] = CachedResponse(
+                body=body, etag=make_etag(body), last_modified=mtime_ns / 1e9, encodings=compress_body(body)
+            )
+        self._files = files
+        self._invalid = invalid
+        self._listing = [
+            {"name": name, "size": size, "modified": mtime}
+            for name, _, size, mtime in signature
+        ]
+        self._bundles = {}
+        self._signature = signature
+
+    def load(self):
+        """立即加载（或在文件变化时重新加载）全部语言文件"""
+        with self._lock:
+            signature = self._scan()
+            if signature != self._signature:
+                self._load(signature)
+            self._checked_at = time.monotonic()
+
+    def needs_check(self):
+        return time.monotonic() - self._checked_at >= self.check_interval
+
+    def list_files(self):
+        return self._listing
+
+    def get_signature(self):
+        """返回最近一次加载时的文件签名（文件名、修改时间、大小），文件有变化时随之改变"""
+        return self._signature
+
+    def get_file(self, name):
+        """返回 (缓存条目, 是否格式无效)"""
+        return self._files.get(name), name in self._invalid
+
+    def get_bundle(self, codes=None):
+        """返回包含多个语言包的合并JSON（{"语言代码": 内容}），codes为空时包含全部语言"""
+        with self._lock:
+            available = {name[:-len(".json")]: cached for name, cached in self._files.items()}
+            codes = tuple(sorted(available if not codes else (code for code in set(codes) if code in available)))
+            bundle = self._bundles.get(codes)
+            if bundle is None:
+                # 语言包已校验为合法JSON，直接拼接原始字节，无需重新序列化
+                parts = [json.dumps(code).encode("utf-8") + b": " + available[code].body for code in codes]
+                body = b"{" + b", ".join(parts) + b"}"
+                last_modified = max((available[code].last_modified for code in codes), default=None)
+                bundle = CachedResponse(
+                    body=body, etag=make_etag(body), last_modified=last_modified, encodings=compress_body(body)
+                )
+                self._bundles[codes] = bundle
+            return bundle
+
+
+LOCALE_STORE = LocaleStore(get_locales_dir())
+
+
+async def ensure_locales_fresh():
+    """按检查间隔确认语言文件是否有变化（在执行器中访问磁盘）"""
+    if LOCALE_STORE.needs_check():
+        await EXECUTOR.run(LOCALE_STORE.load)
 
 
 async def list_locales(request):
     """处理获取 locales 目录下文件列表的请求"""
-    locales_dir = get_locales_dir()
-    
     try:
-        files = []
-        # 遍历目录下所有 .json 文件
-        for entry in os.scandir(locales_dir):
-            if entry.is_file() and entry.name.endswith(".json"):
-                stat = entry.stat()
-                files.append({
-                    "name": entry.name,
-                    "size": stat.st_size,
-                    "modified": stat.st_mtime
-                })
-        
+        await ensure_locales_fresh()
         return web.json_response({
             "directory": "locales",
-            "files": files
+            "files": LOCALE_STORE.list_files()
         })
     except Exception as e:
         logger.error(f"列出语言文件失败: {str(e)}")
@@ -328,30 +2081,42 @@ async def handle_get_locale(request):
     if not filename or not filename.endswith(".json"):
         return web.Response(status=400, text="无效的文件名（必须是 .json 文件）")
 
-    locales_dir = get_locales_dir()
+    locales_dir = LOCALE_STORE.locales_dir
     # 构建文件路径并验证安全性（防止路径遍历攻击）
     filepath = os.path.abspath(os.path.join(locales_dir, filename))
     if os.path.commonpath((locales_dir, filepath)) != locales_dir:
         return web.Response(status=403, text="访问被拒绝：无效路径")
 
-    if not os.path.isfile(filepath):
-        return web.Response(status=404, text="语言文件不存在")
-
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            content = f.read()  # 直接读取原始JSON内容
-        
-        # 返回JSON内容，设置标准JSON的Content-Type
-        return web.Response(
-            body=content,
-            content_type="application/json",  # JSON标准MIME类型
-            charset="utf-8",  # 明确指定UTF-8编码（JSON默认应使用UTF-8）
-            status=200
-        )
+        await ensure_locales_fresh()
+        cached, invalid = LOCALE_STORE.get_file(os.path.relpath(filepath, locales_dir))
+        if invalid:
+            return web.Response(status=500, text="语言文件 JSON 格式无效")
+        if cached is None:
+            return web.Response(status=404, text="语言文件不存在")
+
+        # 返回JSON内容，设置标准JSON的Content-Type，明确指定UTF-8编码
+        return make_cached_response(request, cached, "application/json", charset="utf-8")
     except Exception as e:
         logger.error(f"读取语言文件失败: {str(e)}")
         return web.Response(status=500, text="读取语言文件时发生错误")
-    
+
+
+async def handle_get_locale_bundle(request):
+    """
+    处理语言包合集请求（/ps-comfy-tiheaven-locales-bundle），一次返回所有语言包
+    可选查询参数 names=zh_CN,en_US 只返回指定语言
+    """
+    codes = [code.strip() for code in request.query.get("names", "").split(",") if code.strip()]
+    try:
+        await ensure_locales_fresh()
+        bundle = LOCALE_STORE.get_bundle(codes)
+        return make_cached_response(request, bundle, "application/json", charset="utf-8")
+    except Exception as e:
+        logger.error(f"读取语言包合集失败: {str(e)}")
+        return web.Response(status=500, text="读取语言文件时发生错误")
+
+
 def get_app_version():
     """
     无依赖从pyproject.toml读取version字段
@@ -416,140 +2181,1391 @@ def get_app_version():
 
     return version
 
+# 版本号缓存：pyproject.toml 的修改时间变化时才重新解析
+APP_VERSION_CHECK_INTERVAL = 5.0
+_app_version_cache = {"mtime_ns": None, "version": "0.0.0", "checked_at": None}
+
+
+def get_cached_app_version():
+    """返回缓存的版本号，最多每隔 APP_VERSION_CHECK_INTERVAL 秒检查一次 pyproject.toml 是否被修改"""
+    now = time.monotonic()
+    checked_at = _app_version_cache["checked_at"]
+    if checked_at is not None and now - checked_at < APP_VERSION_CHECK_INTERVAL:
+        return _app_version_cache["version"]
+
+    toml_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyproject.toml")
+    try:
+        mtime_ns = os.stat(toml_path).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    if checked_at is None or mtime_ns != _app_version_cache["mtime_ns"]:
+        _app_version_cache["version"] = get_app_version()
+        _app_version_cache["mtime_ns"] = mtime_ns
+    _app_version_cache["checked_at"] = now
+    return _app_version_cache["version"]
+
+
 async def handle_get_appinfo(request):
     """处理/ps-comfy-tiheaven-appinfo路由请求，返回版本号JSON"""
-    version = get_app_version()
+    version = await EXECUTOR.run(get_cached_app_version)
     return web.json_response({"version": version})
 
+
+def get_server_capabilities():
+    """返回服务端支持的功能及对应路由，供插件决定使用哪些接口"""
+    return {
+        "workflow_conditional_requests": True,
+        "workflow_catalog": {"recursive": True, "search": True, "pagination": True},
+        "workflow_precompile": PRECOMPILE_ENABLED,
+        "locale_bundle": "/ps-comfy-tiheaven-locales-bundle",
+        "batch_thumbnails": "/ps-comfy-tiheaven-get-thumbnails",
+        "thumbnail_conditional_requests": True,
+        "thumbnail_options": {
+            "sizes": list(THUMBNAIL_SIZES),
+            "formats": [name.lower() for name in get_available_thumbnail_formats()],
+            "strip_metadata": True,
+        },
+        "region_preview": {"route": "/ps-comfy-tiheaven-get-region", "max_size": REGION_MAX_SIZE},
+        "compression": list(get_available_encodings()),
+        "client_concurrency": CLIENT_CONCURRENCY or None,
+        "workflow_delta": {"a_im": "json-patch", "history": WORKFLOW_DELTA_HISTORY},
+        "workflow_views": list(WORKFLOW_VIEWS),
+        "metrics": "/ps-comfy-tiheaven-metrics",
+        "profiling": "/ps-comfy-tiheaven-profiles" if PROFILE_ENABLED else None,
+        "change_events": {"event": CHANGE_EVENT, "mode": CHANGE_WATCHER.mode} if CHANGE_WATCHER.mode else None,
+    }
+
+
+# 清单响应缓存：键为 (版本号, 语言文件签名, 工作流索引摘要, 监听模式)，索引变化或监听启动时清空
+_manifest_cache = {"key": None, "response": None}
+_manifest_lock = threading.Lock()
+
+
+def invalidate_manifest(*_):
+    """清空缓存的清单响应（可直接作为工作流索引的变化回调）"""
+    with _manifest_lock:
+        _manifest_cache["key"] = None
+        _manifest_cache["response"] = None
+
+
+def build_manifest():
+    """
+    汇总版本号、语言包摘要、工作流索引摘要和服务端能力，返回清单的缓存条目
+    监听模式为inotify时索引由文件事件保持最新；否则每次请求增量重扫，避免摘要落后后台刷新间隔
+    """
+    if CHANGE_WATCHER.mode == "inotify":
+        WORKFLOW_CATALOG.ensure_loaded()
+    else:
+        WORKFLOW_CATALOG.refresh()
+    if LOCALE_STORE.needs_check():
+        LOCALE_STORE.load()
+    version = get_cached_app_version()
+    workflows_digest = WORKFLOW_CATALOG.get_digest()
+    key = (version, LOCALE_STORE.get_signature(), workflows_digest, CHANGE_WATCHER.mode)
+    with _manifest_lock:
+        if _manifest_cache["key"] == key:
+            return _manifest_cache["response"]
+
+    manifest = {
+        "version": version,
+        "locales": {
+            "digest": LOCALE_STORE.get_bundle().etag.strip('"'),
+            "files": [entry["name"] for entry in LOCALE_STORE.list_files()]
+        },
+        "workflows": {
+            "digest": workflows_digest,
+            "count": WORKFLOW_CATALOG.get_file_count()
+        },
+        "capabilities": get_server_capabilities()
+    }
+    body = json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+    cached = CachedResponse(body=body, etag=make_etag(body), last_modified=None)
+    with _manifest_lock:
+        _manifest_cache["key"] = key
+        _manifest_cache["response"] = cached
+    return cached
+
+
+WORKFLOW_CATALOG.add_listener(invalidate_manifest)
+
+
+async def handle_get_manifest(request):
+    """
+    处理/ps-comfy-tiheaven-manifest路由请求：插件连接时一次获取全部摘要
+    各部分摘要未变化时客户端可跳过对应的后续请求；整体内容未变化时条件请求返回304
+    """
+    try:
+        WORKFLOW_CATALOG.start()
+        cached = await EXECUTOR.run(build_manifest)
+        return make_cached_response(request, cached, "application/json", charset="utf-8")
+    except Exception as e:
+        logger.error(f"生成清单失败: {str(e)}")
+        return web.Response(status=500, text="生成清单时发生错误")
+
+async def handle_get_executor_stats(request):
+    """处理/ps-comfy-tiheaven-executor-stats路由请求，返回共享执行器的排队深度与耗时统计、压缩节省的字节数、缩略图预生成、请求合并和客户端限流统计"""
+    return web.json_response({
+        **EXECUTOR.get_stats(),
+        "compression": get_compression_stats(),
+        "thumbnail_prewarm": THUMBNAIL_PREWARMER.get_stats(),
+        "coalescing": SINGLE_FLIGHT.get_stats(),
+        "client_limit": CLIENT_LIMITER.get_stats(),
+    })
+
+def collect_runtime_metrics():
+    """抓取时读取缓存命中、执行器排队深度和压缩统计，返回Prometheus文本行（热路径上没有额外开销）"""
+    lines = [
+        "# HELP ps_comfy_tiheaven_import_seconds Time spent importing this node pack during ComfyUI startup",
+        "# TYPE ps_comfy_tiheaven_import_seconds gauge",
+        f"ps_comfy_tiheaven_import_seconds {IMPORT_SECONDS}",
+        "# TYPE ps_comfy_tiheaven_cache_hits_total counter",
+        "# TYPE ps_comfy_tiheaven_cache_misses_total counter",
+        "# HELP ps_comfy_tiheaven_cache_hit_ratio Hits / (hits + misses) since startup",
+        "# TYPE ps_comfy_tiheaven_cache_hit_ratio gauge",
+        "# TYPE ps_comfy_tiheaven_cache_bytes gauge",
+    ]
+    caches = {
+        "workflow": WORKFLOW_CACHE,
+        "workflow_patch": WORKFLOW_PATCH_CACHE,
+        "workflow_listing": LISTING_CACHE,
+        "thumbnail_memory": THUMBNAIL_MEMORY_CACHE,
+        "region_pyramid": REGION_PYRAMID_CACHE,
+        "region_memory": REGION_MEMORY_CACHE,
+    }
+    # 磁盘缓存首次使用时才创建，未创建时不输出
+    if _thumbnail_disk_cache is not None:
+        caches["thumbnail_disk"] = _thumbnail_disk_cache
+    for name, cache in caches.items():
+        labels = format_metric_labels((("cache", name),))
+        lookups = cache.hits + cache.misses
+        lines.append(f"ps_comfy_tiheaven_cache_hits_total{labels} {cache.hits}")
+        lines.append(f"ps_comfy_tiheaven_cache_misses_total{labels} {cache.misses}")
+        lines.append(f"ps_comfy_tiheaven_cache_hit_ratio{labels} {cache.hits / lookups if lookups else 0.0}")
+        lines.append(f"ps_comfy_tiheaven_cache_bytes{labels} {cache.current_bytes}")
+
+    executor_stats = EXECUTOR.get_stats()
+    lines += [
+        "# HELP ps_comfy_tiheaven_executor_in_flight Tasks submitted and not finished",
+        "# TYPE ps_comfy_tiheaven_executor_in_flight gauge",
+        "# HELP ps_comfy_tiheaven_executor_queued Tasks waiting for a worker thread",
+        "# TYPE ps_comfy_tiheaven_executor_queued gauge",
+        "# TYPE ps_comfy_tiheaven_executor_tasks_total counter",
+    ]
+    for kind in ("io", "cpu"):
+        stats = executor_stats[kind]
+        lines.append(f"ps_comfy_tiheaven_executor_in_flight{format_metric_labels((('kind', kind),))} {stats['in_flight']}")
+        lines.append(f"ps_comfy_tiheaven_executor_queued{format_metric_labels((('kind', kind),))} {stats['queued']}")
+        for result in ("completed", "failed"):
+            labels = format_metric_labels((("kind", kind), ("result", result)))
+            lines.append(f"ps_comfy_tiheaven_executor_tasks_total{labels} {stats[result]}")
+
+    lines += [
+        "# TYPE ps_comfy_tiheaven_compression_original_bytes_total counter",
+        "# TYPE ps_comfy_tiheaven_compression_sent_bytes_total counter",
+    ]
+    for encoding, stats in COMPRESSION_STATS.items():
+        labels = format_metric_labels((("encoding", encoding),))
+        lines.append(f"ps_comfy_tiheaven_compression_original_bytes_total{labels} {stats['original_bytes']}")
+        lines.append(f"ps_comfy_tiheaven_compression_sent_bytes_total{labels} {stats['sent_bytes']}")
+
+    prewarm_stats = THUMBNAIL_PREWARMER.get_stats()
+    lines += [
+        "# TYPE ps_comfy_tiheaven_thumbnail_prewarm_total counter",
+        "# TYPE ps_comfy_tiheaven_thumbnail_prewarm_pending gauge",
+        f"ps_comfy_tiheaven_thumbnail_prewarm_pending {prewarm_stats['pending']}",
+    ]
+    for result in ("generated", "skipped", "dropped", "failed"):
+        labels = format_metric_labels((("result", result),))
+        lines.append(f"ps_comfy_tiheaven_thumbnail_prewarm_total{labels} {prewarm_stats[result]}")
+
+    lines += [
+        "# HELP ps_comfy_tiheaven_coalesced_total Requests that awaited an identical in-flight computation",
+        "# TYPE ps_comfy_tiheaven_coalesced_total counter",
+        "# TYPE ps_comfy_tiheaven_client_rejected_total counter",
+        f"ps_comfy_tiheaven_client_rejected_total {CLIENT_LIMITER.rejected}",
+    ]
+    for kind, stats in SINGLE_FLIGHT.get_stats().items():
+        lines.append(f"ps_comfy_tiheaven_coalesced_total{format_metric_labels((('work', kind),))} {stats['coalesced']}")
+    return lines
+
+
+async def handle_get_metrics(request):
+    """处理/ps-comfy-tiheaven-metrics路由请求，返回Prometheus文本格式的指标"""
+    body = "\n".join(METRICS.render() + collect_runtime_metrics()) + "\n"
+    return web.Response(
+        body=body.encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8", "Cache-Control": "no-cache"},
+    )
+
+async def list_profiles(request):
+    """处理/ps-comfy-tiheaven-profiles路由请求，按时间从新到旧列出性能分析文件"""
+    store = get_profile_store()
+    profiles = await EXECUTOR.run(store.list_profiles)
+    return web.json_response({"max_files": store.max_files, "profiles": profiles})
+
+
+async def handle_get_profile(request):
+    """下载单个性能分析文件（pstats格式，可用 python -m pstats 或 snakeviz 打开）"""
+    name = request.match_info.get("name", "")
+    data = await EXECUTOR.run(get_profile_store().read, name)
+    if data is None:
+        return web.Response(status=404, text="性能分析文件不存在")
+    return web.Response(
+        body=data, content_type="application/octet-stream",
+        headers={"Content-Disposition": f"attachment; filename=\"{name}\""}
+    )
+
 # 获取input目录的函数
+_input_dir = None
+
+
 def get_input_dir():
-    """获取ComfyUI的input目录"""
-    # 优先通过folder_paths获取input目录
-    input_dir = folder_paths.get_directory_by_type("input")
-    if not input_dir:
-        # 兼容处理，直接在base_path下查找input目录
-        input_dir = os.path.join(folder_paths.base_path, "input")
-    
-    # 确保目录存在
-    os.makedirs(input_dir, exist_ok=True)
-    return input_dir
+    """获取ComfyUI的input目录（首次调用时解析并创建，之后直接返回，请求中不再访问磁盘）"""
+    global _input_dir
+    if _input_dir is None:
+        # 优先通过folder_paths获取input目录
+        input_dir = folder_paths.get_directory_by_type("input")
+        if not input_dir:
+            # 兼容处理，直接在base_path下查找input目录
+            input_dir = os.path.join(folder_paths.base_path, "input")
+
+        # 确保目录存在
+        os.makedirs(input_dir, exist_ok=True)
+        _input_dir = input_dir
+    return _input_dir
+
+# 缩略图参数（参与缓存键计算，修改后旧缓存自动失效）：格式、长边像素、质量、是否去除元数据
+ThumbnailParams = namedtuple("ThumbnailParams", ["format", "size", "quality", "strip_metadata"])
+THUMBNAIL_PARAMS = ThumbnailParams("JPEG", 120, 90, False)
+# 允许的长边尺寸：列表小图、默认面板、HiDPI面板；只接受固定档位以提高缓存命中率
+THUMBNAIL_SIZES = (64, 120, 240)
+
+
+def is_pillow_feature_available(name):
+    """检查Pillow是否编译了指定编解码器（旧版本Pillow不认识的名称视为不可用）"""
+    from PIL import features
 
-# 处理缩略图的路由处理函数
-async def handle_get_thumbnail(request):
-    """处理获取缩略图的请求（/ps-comfy-tiheaven-get-thumbnail）"""
-    filename = request.match_info.get('filename', '')
-    if not filename:
-        return web.Response(status=400, text="缺少filename路径参数")
-    
+    try:
+        return features.check(name)
+    except ValueError:
+        return False
+
+
+# 输出格式：MIME类型、扩展名、默认质量和额外的编码参数（WebP/AVIF取决于Pillow的编译选项）
+THUMBNAIL_FORMATS = {
+    "JPEG": {"mime": "image/jpeg", "ext": "jpg", "quality": 90, "options": {}},
+    "WEBP": {"mime": "image/webp", "ext": "webp", "quality": 80, "options": {"method": 4}},
+    "AVIF": {"mime": "image/avif", "ext": "avif", "quality": 60, "options": {"speed": 8}},
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_available_thumbnail_formats():
+    """当前Pillow可以编码的输出格式（首次调用时检查并缓存）"""
+    return tuple(
+        name for name in THUMBNAIL_FORMATS
+        if name == "JPEG" or is_pillow_feature_available(name.lower())
+    )
+
+
+# Accept中q值相同时的优先顺序：WebP在缩略图尺寸上编码最快，AVIF其次，JPEG兜底
+THUMBNAIL_FORMAT_PREFERENCE = ("WEBP", "AVIF", "JPEG")
+
+
+def negotiate_thumbnail_format(accept):
+    """根据Accept头选择缩略图格式：只认明确列出的 image/webp、image/avif，通配符返回JPEG以兼容旧客户端"""
+    accepted = {}
+    for part in accept.split(","):
+        media_type, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[media_type.strip().lower()] = quality
+    best_format = "JPEG"
+    best_quality = 0.0
+    for name in THUMBNAIL_FORMAT_PREFERENCE:
+        quality = accepted.get(THUMBNAIL_FORMATS[name]["mime"], 0.0)
+        if name in get_available_thumbnail_formats() and quality > best_quality:
+            best_format = name
+            best_quality = quality
+    return best_format
+
+
+def parse_output_format(values, accept=""):
+    """解析 format、quality：未指定format时按Accept协商；返回 (格式, 质量, 格式是否来自协商, 错误信息)"""
+    negotiated = not values.get("format")
+    image_format = negotiate_thumbnail_format(accept) if negotiated else str(values["format"]).upper()
+    if image_format == "JPG":
+        image_format = "JPEG"
+    available = get_available_thumbnail_formats()
+    if image_format not in available:
+        return None, None, False, f"format 只能是 {', '.join(name.lower() for name in available)}"
+
+    quality = values.get("quality")
+    if quality is None or quality == "":
+        quality = THUMBNAIL_FORMATS[image_format]["quality"]
+    else:
+        try:
+            quality = min(100, max(1, int(quality)))
+        except (TypeError, ValueError):
+            return None, None, False, "quality 必须是 1-100 的整数"
+    return image_format, quality, negotiated, None
+
+
+def parse_thumbnail_params(values, accept=""):
+    """
+    从查询参数或批量请求体解析缩略图参数：size、format、quality、strip
+    未指定format时按Accept协商；返回 (ThumbnailParams, 格式是否来自协商, 错误信息)
+    """
+    try:
+        size = int(values.get("size", THUMBNAIL_PARAMS.size))
+    except (TypeError, ValueError):
+        size = None
+    if size not in THUMBNAIL_SIZES:
+        return None, False, f"size 只能是 {', '.join(map(str, THUMBNAIL_SIZES))}"
+
+    image_format, quality, negotiated, error = parse_output_format(values, accept)
+    if error is not None:
+        return None, False, error
+
+    strip_metadata = values.get("strip", False)
+    if not isinstance(strip_metadata, bool):
+        strip_metadata = parse_bool_param(str(strip_metadata))
+    return ThumbnailParams(image_format, size, quality, strip_metadata), negotiated, None
+
+
+# 缩略图缓存：内存热层 + 磁盘持久层，容量可通过环境变量调整（单位MB）
+THUMBNAIL_MEMORY_CACHE = LRUCache(get_env_int("PS_COMFY_TIHEAVEN_THUMBNAIL_MEMORY_MB", 16) * 1024 * 1024)
+_thumbnail_disk_cache = None
+
+
+def get_thumbnail_disk_cache():
+    """获取磁盘缩略图缓存（目录位于input目录旁，首次使用时创建）"""
+    global _thumbnail_disk_cache
+    if _thumbnail_disk_cache is None:
+        cache_dir = os.path.join(os.path.dirname(get_input_dir()), "ps-comfy-tiheaven-thumbnails")
+        _thumbnail_disk_cache = DiskCache(
+            cache_dir, get_env_int("PS_COMFY_TIHEAVEN_THUMBNAIL_CACHE_MB", 256) * 1024 * 1024
+        )
+    return _thumbnail_disk_cache
+
+
+def make_thumbnail_cache_key(signature, params):
+    """根据源文件路径、修改时间、大小和缩略图参数生成内容寻址的缓存键"""
+    raw = "|".join(str(part) for part in (*signature, *params))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def get_thumbnail(filepath, profile=None, params=THUMBNAIL_PARAMS):
+    """
+    获取缩略图：依次查询内存缓存、磁盘缓存，均未命中时生成并写回两级缓存
+    内存缓存未命中后的查找和生成按缓存键合并；传入 profile 时跳过两级缓存和合并，在分析器下重新生成
+    """
+    signature = await EXECUTOR.run(get_file_signature, filepath)
+    cache_key = make_thumbnail_cache_key(signature, params)
+    disk_cache = get_thumbnail_disk_cache()
+    if profile is not None:
+        body = await profile.run(render_thumbnail, filepath, params, cpu_bound=True)
+        await EXECUTOR.run(disk_cache.put, cache_key, body)
+        return cache_thumbnail(cache_key, signature, body)
+
+    THUMBNAIL_PREWARMER.record_params(params)
+    cached = THUMBNAIL_MEMORY_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    async def load():
+        body = await EXECUTOR.run(disk_cache.get, cache_key)
+        if body is None:
+            body = await EXECUTOR.run(render_thumbnail, filepath, params, cpu_bound=True)
+            await EXECUTOR.run(disk_cache.put, cache_key, body)
+        return cache_thumbnail(cache_key, signature, body)
+
+    return await SINGLE_FLIGHT.run("thumbnail", cache_key, load)
+
+
+def cache_thumbnail(cache_key, signature, body):
+    """将缩略图放入内存缓存并返回缓存条目"""
+    cached = CachedResponse(body=body, etag=f'"{cache_key[:32]}"', last_modified=signature[1] / 1e9)
+    THUMBNAIL_MEMORY_CACHE.put(cache_key, cached, len(body))
+    return cached
+
+
+# 新输入图片的缩略图预生成：由文件变化监听触发，在独立的低优先级线程中执行，不占用共享执行器
+THUMBNAIL_PREWARM_ENABLED = get_env_bool("PS_COMFY_TIHEAVEN_THUMBNAIL_PREWARM", True)
+# 请求正在使用共享执行器时，预生成最多让路的时间（秒）
+THUMBNAIL_PREWARM_YIELD = 2.0
+# 预生成最近请求过的几组缩略图参数（尺寸、格式、质量等）；尚无请求时使用默认参数
+THUMBNAIL_PREWARM_PARAM_SETS = get_env_int("PS_COMFY_TIHEAVEN_THUMBNAIL_PREWARM_PARAM_SETS", 3)
+
+
+class ThumbnailPrewarmer:
+    """
+    缩略图预生成队列：单个低优先级后台线程按提交顺序处理，已在内存或磁盘缓存中的图片直接跳过
+    队列达到 max_pending 时丢弃新任务（首次请求时仍会按需生成），共享执行器忙时先让路给请求
+    每张图片按最近请求过的 max_param_sets 组参数生成（如HiDPI面板的240px、协商得到的WebP）
+    """
+
+    def __init__(self, max_pending, max_param_sets):
+        self.max_pending = max_pending
+        self.max_param_sets = max_param_sets
+        self._pending = OrderedDict()  # 文件路径 -> None，保持提交顺序并去重
+        self._recent_params = OrderedDict()  # ThumbnailParams -> None，最近请求的排在最后
+        self._cond = threading.Condition()
+        self._thread = None
+        self.stats = {"generated": 0, "skipped": 0, "dropped": 0, "failed": 0}
+
+    def submit(self, filepaths):
+        with self._cond:
+            for filepath in filepaths:
+                if filepath in self._pending:
+                    continue
+                if len(self._pending) >= self.max_pending:
+                    self.stats["dropped"] += 1
+                    continue
+                self._pending[filepath] = None
+            if self._pending:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="ps-comfy-tiheaven-prewarm", daemon=True)
+                    self._thread.start()
+                self._cond.notify()
+
+    def record_params(self, params):
+        """记录请求使用的缩略图参数（由 get_thumbnail 调用）"""
+        if self.max_param_sets <= 0:
+            return
+        with self._cond:
+            self._recent_params[params] = None
+            self._recent_params.move_to_end(params)
+            while len(self._recent_params) > self.max_param_sets:
+                self._recent_params.popitem(last=False)
+
+    def get_param_sets(self):
+        """预生成使用的参数组：最近请求的在前，尚无请求时为默认参数"""
+        with self._cond:
+            return list(reversed(self._recent_params)) or [THUMBNAIL_PARAMS]
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                **self.stats,
+                "pending": len(self._pending),
+                "params": [params._asdict() for params in reversed(self._recent_params)],
+            }
+
+    def _run(self):
+        if sys.platform.startswith("linux"):
+            try:
+                # Linux下nice值按线程生效，只降低本线程的调度优先级
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+            except OSError:
+                pass
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                filepath, _ = self._pending.popitem(last=False)
+            waited = 0.0
+            while EXECUTOR.in_flight and waited < THUMBNAIL_PREWARM_YIELD:
+                time.sleep(0.05)
+                waited += 0.05
+            try:
+                result = self.prewarm(filepath)
+            except Exception as e:
+                logger.debug(f"预生成缩略图失败: {filepath}: {str(e)}")
+                result = "failed"
+            with self._cond:
+                self.stats[result] += 1
+
+    def prewarm(self, filepath):
+        """
+        与 get_thumbnail 相同的缓存键和生成逻辑，按每组参数分别检查缓存
+        所有参数组都已缓存时返回 skipped，否则生成缺少的并写入两级缓存
+        """
+        signature = get_file_signature(filepath)
+        disk_cache = get_thumbnail_disk_cache()
+        result = "skipped"
+        for params in self.get_param_sets():
+            cache_key = make_thumbnail_cache_key(signature, params)
+            if cache_key in THUMBNAIL_MEMORY_CACHE or cache_key in disk_cache:
+                continue
+            body = render_thumbnail(filepath, params)
+            disk_cache.put(cache_key, body)
+            cache_thumbnail(cache_key, signature, body)
+            result = "generated"
+        return result
+
+
+THUMBNAIL_PREWARMER = ThumbnailPrewarmer(
+    get_env_int("PS_COMFY_TIHEAVEN_THUMBNAIL_PREWARM_QUEUE", 256), THUMBNAIL_PREWARM_PARAM_SETS
+)
+
+
+# 降分辨率解码时保留的倍数：先缩到不小于目标尺寸的该倍数，再用LANCZOS精确缩放
+THUMBNAIL_REDUCING_GAP = 2
+# 支持直接整数倍缩小（reduce）的图像模式
+REDUCIBLE_MODES = ("RGB", "RGBA", "L", "LA")
+
+
+def decode_reduced(img, max_side):
+    """按目标长边降分辨率解码：JPEG通过draft在解码阶段做DCT缩放，其它格式解码后按整数倍reduce"""
+    width, height = img.size
+    min_side = max_side * THUMBNAIL_REDUCING_GAP
+    scale = min_side / max(width, height)
+    if scale >= 1:
+        return img
+
+    if img.format == "JPEG":
+        # draft会选择不小于请求尺寸的最小1/2、1/4、1/8缩放比例，必须在加载像素前调用
+        img.draft(img.mode, (max(1, round(width * scale)), max(1, round(height * scale))))
+        width, height = img.size
+
+    factor = max(width, height) // min_side
+    if factor < 2 or img.mode not in REDUCIBLE_MODES:
+        return img
+    return reduce_image(img, factor)
+
+
+def reduce_image(img, factor):
+    """
+    按整数倍缩小（尺寸向上取整），img.mode 必须属于 REDUCIBLE_MODES
+    RGBA图像先经 flatten_rgba 与灰色背景合成，返回RGB
+    """
+    from PIL import Image
+
+    if img.mode == "RGBA":
+        img = flatten_rgba(img)
+    if img.mode == "LA":
+        # 逐通道缩小：LA只用到alpha通道，避免reduce按alpha预乘灰度通道，同时只保留一个全尺寸通道
+        bands = [img.getchannel(band).reduce(factor) for band in img.getbands()]
+        return Image.merge(img.mode, bands)
+    return img.reduce(factor)
+
+
+# RGBA：深灰色背景的RGB值（0=黑，255=白）
+RGBA_BG_VALUE = 50
+# RGBA：A通道区域的原图透明度比例（1=全透，0=完全不透明）
+RGBA_AREA_OPACITY_RATIO = 0.25
+# RGBA混合掩码查找表：
+# 非A通道（Alpha=255）→ 掩码=255（显示完全不透明原图）
+# A通道（Alpha=0~254）→ 掩码=(255 - Alpha) * 透明度比例，随透明程度渐变
+RGBA_MASK_LUT = [255 if x == 255 else int((255 - x) * RGBA_AREA_OPACITY_RATIO) for x in range(256)]
+# L/LA：alpha为0显示深灰色，为255显示白色，中间按alpha线性过渡
+LA_BG_VALUE = 100
+LA_LUT = [round(LA_BG_VALUE + (255 - LA_BG_VALUE) * x / 255) for x in range(256)]
+# 灰色背景的混合权重（255 - 掩码），用于在RGB图像上原地叠加背景
+RGBA_BG_WEIGHT_LUT = [255 - x for x in RGBA_MASK_LUT]
+
+
+def flatten_rgba(img):
+    """
+    按混合掩码把RGBA图像与灰色背景合成为RGB：在转换出的RGB图像上原地叠加背景，除掩码外只分配一个全尺寸缓冲区
+    必须在任何缩放之前合成：RGB与掩码分别缩放（或按掩码预乘后以8位缩放）会把透明区域下的颜色（通常为黑色）带进选区边缘
+    """
+    background_weight = img.getchannel('A').point(RGBA_BG_WEIGHT_LUT)
+    rgb_img = img.convert('RGB')
+    rgb_img.paste((RGBA_BG_VALUE, RGBA_BG_VALUE, RGBA_BG_VALUE), None, background_weight)
+    return rgb_img
+
+
+def compose_preview(img, size, box=None):
+    """
+    缩放到 size 并把透明区域与灰色背景混合，返回RGB图像；box 为 resize 的源区域（可为小数坐标）
+    处理不同通道情况：RGBA先与背景合成再缩放（与原实现一致），L/LA先缩放alpha再查表
+    """
+    from PIL import Image
+
+    if img.mode == "RGBA":
+        return flatten_rgba(img).resize(size, Image.Resampling.LANCZOS, box)
+    if img.mode in ["L", "LA"]:
+        # 只有alpha通道或灰度+alpha通道：LA取alpha通道，L将灰度视为alpha
+        a = img.getchannel('A') if img.mode == "LA" else img
+        # 灰色到白色的过渡是线性的，可先缩放alpha再查表，最后转换为RGB
+        return a.resize(size, Image.Resampling.LANCZOS, box).point(LA_LUT).convert("RGB")
+    # 其他模式转换为RGB后缩放（已是RGB时不再复制）
+    rgb_img = img if img.mode == "RGB" else img.convert("RGB")
+    return rgb_img.resize(size, Image.Resampling.LANCZOS, box)
+
+
+def render_thumbnail(filepath, params=THUMBNAIL_PARAMS):
+    """生成缩略图（透明区域与灰色背景混合、长边缩放到 params.size），按 params 的格式和质量编码后返回字节"""
+    from PIL import Image
+
+    started_at = metric_clock()
+    with Image.open(filepath) as source:
+        original_exif = source.info.get('exif', b'')
+
+        # 计算缩略图尺寸（长边为 params.size），使用原图尺寸避免降分辨率解码的取整误差影响宽高比
+        width, height = source.size
+        if width > height:
+            new_width = params.size
+            new_height = max(1, int((height / width) * new_width))
+        else:
+            new_height = params.size
+            new_width = max(1, int((width / height) * new_height))
+        size = (new_width, new_height)
+
+        img = decode_reduced(source, params.size)
+        img.load()  # 未缩小时像素延迟加载，显式加载使解码耗时计入decode阶段
+        phase_labels = (("mode", source.mode), ("format", params.format))
+        started_at = observe_since("ps_comfy_tiheaven_thumbnail_phase_seconds", started_at, (("phase", "decode"),) + phase_labels)
+        thumbnail = compose_preview(img, size)
+        started_at = observe_since("ps_comfy_tiheaven_thumbnail_phase_seconds", started_at, (("phase", "resize"),) + phase_labels)
+
+        # 按指定格式保存到内存缓冲区，去除元数据时不复制原图的EXIF
+        save_options = dict(THUMBNAIL_FORMATS[params.format]["options"], quality=params.quality)
+        if original_exif and not params.strip_metadata:
+            save_options["exif"] = original_exif
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format=params.format, **save_options)
+        observe_since("ps_comfy_tiheaven_thumbnail_phase_seconds", started_at, (("phase", "encode"),) + phase_labels)
+        return buffer.getvalue()
+
+def is_image_filename(filename):
+    """根据扩展名判断是否为图片文件"""
+    import mimetypes
+
+    content_type = mimetypes.guess_type(filename)[0]
+    return bool(content_type) and content_type.startswith('image/')
+
+
+def resolve_input_image(filename):
+    """
+    校验input目录下的图片文件名，返回 (文件路径, 错误状态码, 错误信息)，校验通过时状态码为None
+    会检查文件是否存在，需在执行器中调用
+    """
     input_dir = get_input_dir()
-    
+
     # 安全验证：防止路径遍历攻击
     filepath = os.path.abspath(os.path.join(input_dir, filename))
     if os.path.commonpath((input_dir, filepath)) != input_dir:
-        return web.Response(status=403, text="访问被拒绝：无效路径")
-    
+        return None, 403, "访问被拒绝：无效路径"
+
     # 检查文件是否存在
     if not os.path.isfile(filepath):
-        return web.Response(status=404, text="图片文件不存在")
-    
+        return None, 404, "图片文件不存在"
+
     # 检查文件是否为图片类型
-    content_type = mimetypes.guess_type(filename)[0]
-    if not content_type or not content_type.startswith('image/'):
-        return web.Response(status=400, text="指定文件不是图片类型")
+    if not is_image_filename(filename):
+        return None, 400, "指定文件不是图片类型"
+
+    return filepath, None, None
+
+
+# 处理缩略图的路由处理函数
+async def handle_get_thumbnail(request):
+    """
+    处理获取缩略图的请求（/ps-comfy-tiheaven-get-thumbnail）
+    可选查询参数：size（64/120/240）、format（jpeg/webp/avif，默认按Accept协商）、quality（1-100）、strip=1 去除元数据
+    开启性能分析时 profile=1 会在分析器下重新生成
+    """
+    filename = request.match_info.get('filename', '')
+    if not filename:
+        return web.Response(status=400, text="缺少filename路径参数")
+
+    params, negotiated, error_text = parse_thumbnail_params(request.query, request.headers.get("Accept", ""))
+    if params is None:
+        return web.Response(status=400, text=error_text)
     
-    try:
-        with Image.open(filepath) as img:
-            original_exif = img.info.get('exif', b'')
-            # 处理不同通道情况
-            if img.mode == "RGBA":
-                GRAY_BG_VALUE = 50  # 深灰色背景的RGB值（0=黑，255=白）
-                AREA_OPACITY_RATIO = 0.25  # A通道区域的原图透明度比例（1=全透，0=完全不透明）
-                # 1. 创建不透明的灰色背景（底层）
-                gray_bg = Image.new('RGB', img.size, (GRAY_BG_VALUE, GRAY_BG_VALUE, GRAY_BG_VALUE))
-                # 2. 提取原图的RGB通道和Alpha通道
-                rgb_img = img.convert('RGB')  # 纯原图RGB（无Alpha）
-                alpha_channel = img.split()[3]  # 原图Alpha通道（0=全透，255=完全不透明）
-
-                # 3. 重构混合掩码：核心修正逻辑
-                # 非A通道（Alpha=255）→ 掩码=255（显示完全不透明原图）
-                # A通道（Alpha=0~255）→ 掩码=255 - Alpha → 随透明程度渐变，再乘以自定义透明度
-                def calculate_mask(x):
-                    if x == 255:  # 非A通道，强制显示原图
-                        return 255
-                    # A通道：用255-x得到透明区域的渐变值，再乘以自定义透明度
-                    return int((255 - x) * AREA_OPACITY_RATIO)
-                mixed_alpha = alpha_channel.point(calculate_mask)
-                
-                # 4. 像素级混合：按修正后的掩码实现叠加效果
-                processed_img = Image.composite(rgb_img, gray_bg, mixed_alpha)
-            elif img.mode in ["L", "LA"]:
-                # 只有alpha通道或灰度+alpha通道，转换为RGB
-                gray_value = 100  # 深灰色
-                white = 255       # 白色
-                
-                # 创建RGB图像
-                rgb_img = Image.new('RGB', img.size, (gray_value, gray_value, gray_value))
-                
-                # 提取alpha通道（如果存在）
-                if img.mode == "LA":
-                    _, a = img.split()
-                else:  # "L"模式，将灰度视为alpha
-                    a = img
-                
-                # 创建白色图层并应用alpha遮罩
-                white_layer = Image.new('RGB', img.size, (white, white, white))
-                rgb_img.paste(white_layer, mask=a)
-                processed_img = rgb_img
-            else:
-                # 其他模式直接转换为RGB
-                processed_img = img.convert("RGB")
-            
-            # 计算缩略图尺寸（长边为120px）
-            width, height = processed_img.size
-            if width > height:
-                new_width = 120
-                new_height = int((height / width) * new_width)
-            else:
-                new_height = 120
-                new_width = int((width / height) * new_height)
-            
-            # 生成缩略图
-            thumbnail = processed_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # 保存为JPG到内存缓冲区
-            buffer = io.BytesIO()
-            thumbnail.save(buffer, format = "JPEG" , quality = 90, exif = original_exif)
-            buffer.seek(0)
-            
-            # 返回处理后的图片
-            return web.Response(
-                body=buffer.read(),
-                content_type="image/jpeg",
-                headers={"Content-Disposition": f"filename=\"thumbnail_{filename}.jpg\""}
-            )
+    filepath, error_status, error_text = await EXECUTOR.run(resolve_input_image, filename)
+    if error_status is not None:
+        return web.Response(status=error_status, text=error_text)
     
+    try:
+        profile = start_profile(request, f"thumbnail-{filename}")
+        cached = await get_thumbnail(filepath, profile, params)
+
+        # 返回处理后的图片（条件请求命中时返回304）
+        image_format = THUMBNAIL_FORMATS[params.format]
+        headers = {"Content-Disposition": f"filename=\"thumbnail_{filename}.{image_format['ext']}\""}
+        if negotiated:
+            headers["Vary"] = "Accept"
+        response = make_cached_response(request, cached, image_format["mime"], headers=headers)
+        return profile.annotate(response) if profile is not None else response
+    except ClientLimitExceeded:
+        return make_too_many_requests_response()
     except Exception as e:
         logger.error(f"处理缩略图失败: {str(e)}")
         return web.Response(status=500, text="处理图片时发生错误")
 
+# 批量缩略图请求同时生成的数量上限（避免单个批量请求占满共享执行器）
+BATCH_THUMBNAIL_CONCURRENCY = get_env_int("PS_COMFY_TIHEAVEN_BATCH_THUMBNAIL_CONCURRENCY", 4)
+# multipart响应的分隔符
+BATCH_THUMBNAIL_BOUNDARY = "ps-comfy-tiheaven-thumbnail"
+
+
+def list_input_images(target_dir):
+    """列出目录下（不递归）的图片文件，返回相对input目录的路径；目录不存在时返回None"""
+    if not os.path.isdir(target_dir):
+        return None
+    input_dir = get_input_dir()
+    return sorted(
+        os.path.relpath(entry.path, input_dir).replace(os.sep, "/")
+        for entry in os.scandir(target_dir)
+        if entry.is_file() and is_image_filename(entry.name)
+    )
+
+
+def encode_batch_thumbnail_item(filename, status, result, use_multipart, content_type="image/jpeg"):
+    """将单个批量结果编码为NDJSON行或multipart分段；成功时result为缓存条目，失败时为错误信息"""
+    if use_multipart:
+        headers = [f"X-Filename: {json.dumps(filename)}", f"X-Status: {status}"]
+        if status == 200:
+            headers += [f"Content-Type: {content_type}", f"ETag: {result.etag}"]
+            body = result.body
+        else:
+            headers.append("Content-Type: text/plain; charset=utf-8")
+            body = result.encode("utf-8")
+        head = f"--{BATCH_THUMBNAIL_BOUNDARY}\r\n" + "\r\n".join(headers) + "\r\n\r\n"
+        return head.encode("utf-8") + body + b"\r\n"
+
+    item = {"filename": filename, "status": status}
+    if status == 200:
+        item.update({
+            "content_type": content_type,
+            "etag": result.etag,
+            "data": base64.b64encode(result.body).decode("ascii")
+        })
+    else:
+        item["error"] = result
+    return (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def handle_get_thumbnails(request):
+    """
+    处理批量缩略图请求（POST /ps-comfy-tiheaven-get-thumbnails）
+    请求体：{"filenames": [...]} 或 {"subdir": "子目录"}（相对input目录），可选 size/format/quality/strip（同单张缩略图）
+    默认以NDJSON按完成顺序逐条返回；Accept包含multipart/mixed时返回multipart流
+    单个文件出错只影响该条结果，不会中断整个批量请求
+    """
+    try:
+        payload = await request.json()
+    except Exception:
+        return web.Response(status=400, text="请求体必须是JSON")
+    if not isinstance(payload, dict):
+        return web.Response(status=400, text="请求体必须是JSON对象")
+
+    filenames = payload.get("filenames")
+    subdir = payload.get("subdir")
+    if subdir is not None:
+        input_dir = get_input_dir()
+        target_dir = os.path.abspath(os.path.join(input_dir, str(subdir)))
+        if os.path.commonpath((input_dir, target_dir)) != input_dir:
+            return web.Response(status=403, text="访问被拒绝：无效路径")
+        filenames = await EXECUTOR.run(list_input_images, target_dir)
+        if filenames is None:
+            return web.Response(status=404, text="目录不存在")
+    elif not isinstance(filenames, list) or not all(isinstance(name, str) for name in filenames):
+        return web.Response(status=400, text="缺少filenames列表或subdir参数")
+
+    # Accept用于选择multipart/NDJSON，批量请求的格式只由请求体的format指定，默认JPEG
+    params, _, error_text = parse_thumbnail_params(payload)
+    if params is None:
+        return web.Response(status=400, text=error_text)
+    content_type = THUMBNAIL_FORMATS[params.format]["mime"]
+
+    use_multipart = "multipart/mixed" in request.headers.get("Accept", "")
+    response = web.StreamResponse()
+    if use_multipart:
+        response.content_type = f"multipart/mixed; boundary={BATCH_THUMBNAIL_BOUNDARY}"
+    else:
+        response.content_type = "application/x-ndjson"
+    await response.prepare(request)
+
+    semaphore = asyncio.Semaphore(BATCH_THUMBNAIL_CONCURRENCY)
+
+    async def process(filename):
+        # 文件检查也在信号量内执行，大批量请求不会一次占满执行器的排队名额
+        async with semaphore:
+            try:
+                filepath, error_status, error_text = await EXECUTOR.run(resolve_input_image, filename)
+                if error_status is not None:
+                    return filename, error_status, error_text
+                return filename, 200, await get_thumbnail(filepath, params=params)
+            except Exception as e:
+                logger.error(f"处理缩略图失败: {filename}: {str(e)}")
+                return filename, 500, "处理图片时发生错误"
+
+    tasks = [asyncio.ensure_future(process(filename)) for filename in filenames]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            filename, status, result = await next_done
+            await response.write(encode_batch_thumbnail_item(filename, status, result, use_multipart, content_type))
+        if use_multipart:
+            await response.write(f"--{BATCH_THUMBNAIL_BOUNDARY}--\r\n".encode("utf-8"))
+    finally:
+        # 客户端中途断开时取消尚未完成的任务
+        for task in tasks:
+            task.cancel()
+
+    await response.write_eof()
+    return response
+
+# 局部区域预览：按原图坐标裁剪并缩放到指定长边，从缓存的多分辨率金字塔取像素，平移缩放时不必重新解码原图
+RegionParams = namedtuple("RegionParams", ["box", "size", "format", "quality"])
+# 输出长边的默认值和上下限
+REGION_DEFAULT_SIZE = 1024
+REGION_MIN_SIZE = 16
+REGION_MAX_SIZE = 2048
+# 金字塔顶层的长边上限：每层为上一层的1/2，直到长边不超过该值
+REGION_PYRAMID_MIN_SIDE = 256
+# 裁剪时在区域外多保留的像素，保证LANCZOS在区域边缘采样到真实的相邻像素，相邻区域拼接时没有接缝
+REGION_CROP_MARGIN = 6
+
+# 金字塔各层解码后的像素缓存，键为 (文件签名, 层级)，容量可通过环境变量调整（单位MB）
+REGION_PYRAMID_CACHE = LRUCache(get_env_int("PS_COMFY_TIHEAVEN_REGION_CACHE_MB", 256) * 1024 * 1024)
+# 编码后的区域预览缓存，重复请求同一区域时直接返回
+REGION_MEMORY_CACHE = LRUCache(16 * 1024 * 1024)
+
+
+class InvalidRegionError(ValueError):
+    """裁剪区域超出图片范围"""
+
+
+def parse_region_params(values, accept=""):
+    """
+    解析区域预览参数：x、y、w、h（原图像素坐标，省略 w、h 时延伸到图片边缘）、size（输出长边）、format、quality
+    返回 (RegionParams, 格式是否来自协商, 错误信息)
+    """
+    try:
+        x = int(values.get("x", 0))
+        y = int(values.get("y", 0))
+        w = int(values["w"]) if values.get("w") not in (None, "") else None
+        h = int(values["h"]) if values.get("h") not in (None, "") else None
+    except (TypeError, ValueError):
+        return None, False, "x、y、w、h 必须是整数"
+    if x < 0 or y < 0 or (w is not None and w <= 0) or (h is not None and h <= 0):
+        return None, False, "x、y 必须是非负整数，w、h 必须是正整数"
+
+    try:
+        size = int(values.get("size", REGION_DEFAULT_SIZE))
+    except (TypeError, ValueError):
+        size = 0
+    if not REGION_MIN_SIZE <= size <= REGION_MAX_SIZE:
+        return None, False, f"size 必须在 {REGION_MIN_SIZE}-{REGION_MAX_SIZE} 之间"
+
+    image_format, quality, negotiated, error = parse_output_format(values, accept)
+    if error is not None:
+        return None, False, error
+    return RegionParams((x, y, w, h), size, image_format, quality), negotiated, None
+
+
+@functools.lru_cache(maxsize=1024)
+def get_image_size(signature):
+    """只读取文件头获取原图尺寸；签名包含修改时间，文件变化后自动使用新条目"""
+    from PIL import Image
+
+    with Image.open(signature[0]) as img:
+        return img.size
+
+
+def get_pyramid_top_level(image_size):
+    """金字塔最高层级：长边缩小到不超过 REGION_PYRAMID_MIN_SIDE"""
+    level = 0
+    long_side = max(image_size)
+    while long_side > REGION_PYRAMID_MIN_SIDE:
+        long_side = (long_side + 1) // 2
+        level += 1
+    return level
+
+
+def decode_pyramid_base(filepath, level):
+    """
+    解码原图作为金字塔的起点，返回 (层级, 图像)
+    JPEG通过draft在解码阶段直接缩小到不大于 level 的最近一层（最多1/8），其它格式按原尺寸解码
+    """
+    from PIL import Image
+
+    with Image.open(filepath) as source:
+        width, height = source.size
+        if source.format == "JPEG" and level > 0:
+            scale = 1 << level
+            source.draft(source.mode, ((width + scale - 1) // scale, (height + scale - 1) // scale))
+        source.load()
+        # draft的缩放比例为2的幂且尺寸向上取整，与金字塔各层尺寸一致
+        base_level = 0
+        while source.size[0] < (width + (1 << base_level) - 1) >> base_level:
+            base_level += 1
+        # RGBA在缓存前与灰色背景合成，各层按RGB缩小（也比RGBA少占四分之一内存）
+        if source.mode == "RGBA":
+            return base_level, flatten_rgba(source)
+        return base_level, source if source.mode in REDUCIBLE_MODES else source.convert("RGB")
+
+
+def get_pyramid_level(filepath, signature, level):
+    """
+    返回金字塔第 level 层（1/2^level 缩放，尺寸向上取整）
+    未缓存时从已缓存的更精细层缩小，没有时重新解码原图；生成的各层到顶层为止都写入缓存
+    """
+    cached = REGION_PYRAMID_CACHE.get((signature, level))
+    if cached is not None:
+        return cached
+
+    base_level = next(
+        (finer for finer in range(level - 1, -1, -1) if (signature, finer) in REGION_PYRAMID_CACHE), None
+    )
+    img = REGION_PYRAMID_CACHE.get((signature, base_level)) if base_level is not None else None
+    if img is None:
+        base_level, img = decode_pyramid_base(filepath, level)
+
+    top_level = get_pyramid_top_level(get_image_size(signature))
+    result = None
+    for current in range(base_level, top_level + 1):
+        if current > base_level:
+            img = reduce_image(img, 2)
+        nbytes = img.width * img.height * len(img.getbands())
+        if current == level:
+            result = img
+        # 比请求更精细的层只在足够小时缓存，避免单张大图的原尺寸层挤出其它图片的金字塔
+        if current >= level or nbytes <= REGION_PYRAMID_CACHE.max_bytes // 4:
+            if (signature, current) not in REGION_PYRAMID_CACHE:
+                REGION_PYRAMID_CACHE.put((signature, current), img, nbytes)
+    return result
+
+
+def render_region(filepath, signature, params):
+    """按 params 裁剪原图区域并缩放到长边不超过 params.size（不放大），透明区域处理与缩略图一致，返回编码后的字节"""
+    started_at = metric_clock()
+    width, height = get_image_size(signature)
+    x, y, w, h = params.box
+    w = width - x if w is None else w
+    h = height - y if h is None else h
+    # 起点必须在图片内、区域非空且不越界（省略 w、h 时起点越界会得到非正的宽高）
+    if x >= width or y >= height or w <= 0 or h <= 0 or x + w > width or y + h > height:
+        raise InvalidRegionError(f"区域超出图片范围（{width}x{height}）")
+
+    scale = min(1.0, params.size / max(w, h))
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    # 选择分辨率不低于输出尺寸的最粗一层
+    top_level = get_pyramid_top_level((width, height))
+    level = 0
+    while level < top_level and scale * (2 << level) <= 1:
+        level += 1
+    pyramid = get_pyramid_level(filepath, signature, level)
+    phase_labels = (("level", level),)
+    started_at = observe_since("ps_comfy_tiheaven_region_phase_seconds", started_at, (("phase", "pyramid"),) + phase_labels)
+
+    # 区域映射到该层坐标后先按整数像素（加边距）裁剪，再用小数坐标的box精确缩放
+    fx = pyramid.width / width
+    fy = pyramid.height / height
+    left, top, right, bottom = x * fx, y * fy, (x + w) * fx, (y + h) * fy
+    crop_box = (
+        max(0, int(left) - REGION_CROP_MARGIN),
+        max(0, int(top) - REGION_CROP_MARGIN),
+        min(pyramid.width, int(right) + 1 + REGION_CROP_MARGIN),
+        min(pyramid.height, int(bottom) + 1 + REGION_CROP_MARGIN),
+    )
+    region = pyramid.crop(crop_box)
+    box = (left - crop_box[0], top - crop_box[1], right - crop_box[0], bottom - crop_box[1])
+    preview = compose_preview(region, size, box)
+    started_at = observe_since("ps_comfy_tiheaven_region_phase_seconds", started_at, (("phase", "resize"),) + phase_labels)
+
+    buffer = io.BytesIO()
+    preview.save(buffer, format=params.format, **dict(THUMBNAIL_FORMATS[params.format]["options"], quality=params.quality))
+    observe_since("ps_comfy_tiheaven_region_phase_seconds", started_at, (("phase", "encode"),) + phase_labels)
+    return buffer.getvalue()
+
+
+async def get_region(filepath, params, profile=None):
+    """
+    获取区域预览：命中编码缓存时直接返回，否则从金字塔生成（并发的相同请求合并为一次生成）
+    金字塔缓存在本进程内，生成在执行器线程中执行；传入 profile 时跳过编码缓存和合并
+    """
+    signature = await EXECUTOR.run(get_file_signature, filepath)
+    cache_key = make_thumbnail_cache_key(signature, ("region", *params))
+    if profile is not None:
+        body = await profile.run(render_region, filepath, signature, params)
+        return cache_region(cache_key, signature, body)
+
+    cached = REGION_MEMORY_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    async def render():
+        body = await EXECUTOR.run(render_region, filepath, signature, params)
+        return cache_region(cache_key, signature, body)
+
+    return await SINGLE_FLIGHT.run("region", cache_key, render)
+
+
+def cache_region(cache_key, signature, body):
+    """将区域预览放入内存缓存并返回缓存条目"""
+    cached = CachedResponse(body=body, etag=f'"{cache_key[:32]}"', last_modified=signature[1] / 1e9)
+    REGION_MEMORY_CACHE.put(cache_key, cached, len(body))
+    return cached
+
+
+async def handle_get_region(request):
+    """
+    处理区域预览请求（/ps-comfy-tiheaven-get-region）：返回原图中 x、y、w、h 区域缩放到长边 size 后的图片
+    format（默认按Accept协商）和 quality 同缩略图；开启性能分析时 profile=1 会在分析器下重新生成
+    """
+    filename = request.match_info.get('filename', '')
+    if not filename:
+        return web.Response(status=400, text="缺少filename路径参数")
+
+    params, negotiated, error_text = parse_region_params(request.query, request.headers.get("Accept", ""))
+    if params is None:
+        return web.Response(status=400, text=error_text)
+
+    filepath, error_status, error_text = await EXECUTOR.run(resolve_input_image, filename)
+    if error_status is not None:
+        return web.Response(status=error_status, text=error_text)
+
+    try:
+        profile = start_profile(request, f"region-{filename}")
+        cached = await get_region(filepath, params, profile)
+
+        image_format = THUMBNAIL_FORMATS[params.format]
+        headers = {"Content-Disposition": f"filename=\"region_{filename}.{image_format['ext']}\""}
+        if negotiated:
+            headers["Vary"] = "Accept"
+        response = make_cached_response(request, cached, image_format["mime"], headers=headers)
+        return profile.annotate(response) if profile is not None else response
+    except ClientLimitExceeded:
+        return make_too_many_requests_response()
+    except InvalidRegionError as e:
+        return web.Response(status=400, text=str(e))
+    except Exception as e:
+        logger.error(f"处理区域预览失败: {str(e)}")
+        return web.Response(status=500, text="处理图片时发生错误")
+
+# 文件变化推送：监听工作流目录和input目录，通过 PromptServer.send_sync 广播给所有客户端
+WATCH_ENABLED = get_env_bool("PS_COMFY_TIHEAVEN_WATCH", True)
+# 未安装watchdog时的轮询间隔（秒）；安装时作为兜底的完整扫描间隔
+WATCH_POLL_INTERVAL = get_env_int("PS_COMFY_TIHEAVEN_WATCH_INTERVAL", 5)
+# 防抖：最后一个文件事件后等待的时间，以及首个事件后最长等待的时间（秒）
+WATCH_DEBOUNCE = get_env_int("PS_COMFY_TIHEAVEN_WATCH_DEBOUNCE_MS", 500) / 1000
+WATCH_MAX_DELAY = WATCH_DEBOUNCE * 4
+CHANGE_EVENT = "ps-comfy-tiheaven-changes"
+# 会改变目录内容的watchdog事件类型
+WATCH_EVENT_TYPES = ("created", "modified", "deleted", "moved")
+
+
+def broadcast_changes(scope, changes):
+    """
+    把变化列表按类型分组后广播，如 {"scope": "workflows", "added": [...], "removed": [...], "digest": ...}
+    工作流变化附带索引摘要，与 manifest 中的 workflows_digest 一致
+    """
+    server = get_prompt_server()
+    if not server or not changes:
+        return
+    payload = {"scope": scope}
+    for change, path in changes:
+        payload.setdefault(change, []).append(path)
+    if scope == "workflows":
+        payload["digest"] = WORKFLOW_CATALOG.get_digest()
+    server.send_sync(CHANGE_EVENT, payload)
+
+
+class InputImageMonitor:
+    """input目录（递归，跳过隐藏目录）中图片文件的快照，刷新时与上次快照比较返回变化列表"""
+
+    def __init__(self):
+        self._snapshot = None  # 相对路径 -> (修改时间ns, 大小)
+        self._lock = threading.Lock()
+
+    def scan(self):
+        input_dir = get_input_dir()
+        snapshot = {}
+        for root, dirnames, filenames in os.walk(input_dir):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            for name in filenames:
+                if not is_image_filename(name):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[os.path.relpath(path, input_dir).replace(os.sep, "/")] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def refresh(self):
+        """重新扫描并返回变化列表 [(类型, 相对路径)]；首次扫描只建立快照"""
+        snapshot = self.scan()
+        with self._lock:
+            old_snapshot, self._snapshot = self._snapshot, snapshot
+        if old_snapshot is None:
+            return []
+        changes = [
+            ("modified" if path in old_snapshot else "added", path)
+            for path, state in snapshot.items() if old_snapshot.get(path) != state
+        ]
+        changes.extend(("removed", path) for path in old_snapshot if path not in snapshot)
+        return changes
+
+
+class ChangeWatcher:
+    """
+    文件变化监听：安装了watchdog时使用inotify等系统通知，事件经防抖后只重扫有变化的一侧；
+    未安装或启动失败时按 WATCH_POLL_INTERVAL 轮询。工作流变化来自 WORKFLOW_CATALOG 的增量扫描
+    """
+
+    def __init__(self, workflow_dir, poll_interval, debounce, max_delay):
+        self.workflow_dir = workflow_dir
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.input_dir = None
+        self.inputs = InputImageMonitor()
+        self.mode = None  # "inotify"（watchdog）或 "polling"
+        self._dirty = set()  # 有待处理事件的范围：workflows / inputs
+        self._first_event_at = None
+        self._last_event_at = None
+        self._cond = threading.Condition()
+        self._observer = None
+        self._thread = None
+
+    def get_event_scope(self, path):
+        """返回文件事件所属的范围；不在监听目录内或位于隐藏目录（如预编译结果的写入）时返回None"""
+        path = os.path.abspath(os.fsdecode(path))
+        for scope, root in (("workflows", self.workflow_dir), ("inputs", self.input_dir)):
+            if root and path.startswith(root + os.sep):
+                if any(part.startswith(".") for part in os.path.relpath(path, root).split(os.sep)):
+                    return None
+                return scope
+        return None
+
+    def dispatch(self, event):
+        """watchdog事件回调（在watchdog线程中执行）：只记录范围和时间，扫描在监听线程中进行"""
+        # 只处理会改变目录内容的事件；打开、只读关闭等访问事件（读取缩略图、加载工作流）不触发重扫
+        if event.event_type not in WATCH_EVENT_TYPES:
+            return
+        paths = [event.src_path]
+        if event.event_type == "moved":
+            # 移动同时影响源和目标：从隐藏临时目录移入的文件按目标路径判断
+            paths.append(event.dest_path)
+        scopes = {scope for scope in map(self.get_event_scope, paths) if scope is not None}
+        if not scopes:
+            return
+        with self._cond:
+            now = time.monotonic()
+            if not self._dirty:
+                self._first_event_at = now
+            self._dirty.update(scopes)
+            self._last_event_at = now
+            self._cond.notify()
+
+    def _start_observer(self):
+        try:
+            from watchdog.observers import Observer  # 可选依赖：未安装时文件变化监听改为轮询
+        except ImportError:
+            return False
+        try:
+            observer = Observer()
+            observer.schedule(self, self.workflow_dir, recursive=True)
+            observer.schedule(self, self.input_dir, recursive=True)
+            observer.daemon = True
+            observer.start()
+        except Exception as e:
+            # inotify句柄数超限等情况下退回轮询
+            logger.warning(f"启动文件监听失败，改为轮询: {str(e)}")
+            return False
+        self._observer = observer
+        return True
+
+    def _wait_for_changes(self):
+        """等待事件并防抖，返回需要重扫的范围；轮询或兜底间隔到期时返回全部范围"""
+        with self._cond:
+            if not self._dirty:
+                self._cond.wait(self.poll_interval if self.mode == "polling" else self.poll_interval * 12)
+                if not self._dirty:
+                    return {"workflows", "inputs"}
+            # 最后一个事件后安静 debounce 秒，或距首个事件超过 max_delay 秒时处理
+            while True:
+                now = time.monotonic()
+                remaining = min(self._last_event_at + self.debounce, self._first_event_at + self.max_delay) - now
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            scopes, self._dirty = self._dirty, set()
+            return scopes
+
+    def _run(self):
+        # 先建立两侧的初始快照，之后的扫描结果才是真正的变化
+        self.inputs.refresh()
+        WORKFLOW_CATALOG.refresh()
+        WORKFLOW_CATALOG.add_listener(lambda changes: broadcast_changes("workflows", changes))
+        while True:
+            scopes = self._wait_for_changes()
+            try:
+                if "workflows" in scopes:
+                    # 变化由 WORKFLOW_CATALOG 的监听回调广播
+                    WORKFLOW_CATALOG.refresh()
+                if "inputs" in scopes:
+                    changes = self.inputs.refresh()
+                    broadcast_changes("inputs", changes)
+                    if THUMBNAIL_PREWARM_ENABLED:
+                        THUMBNAIL_PREWARMER.submit(
+                            os.path.join(self.input_dir, *path.split("/"))
+                            for change, path in changes if change != "removed"
+                        )
+            except Exception as e:
+                logger.error(f"检查文件变化失败: {str(e)}")
+
+    def start(self):
+        """启动监听（重复调用无副作用）"""
+        if self._thread is not None:
+            return
+        self.input_dir = get_input_dir()
+        self.mode = "inotify" if self._start_observer() else "polling"
+        invalidate_manifest()  # 清单的能力部分包含监听模式
+        self._thread = threading.Thread(target=self._run, name="ps-comfy-tiheaven-watcher", daemon=True)
+        self._thread.start()
+
+
+CHANGE_WATCHER = ChangeWatcher(WORKFLOW_DIR, WATCH_POLL_INTERVAL, WATCH_DEBOUNCE, WATCH_MAX_DELAY)
+
+
+def start_change_watcher():
+    """开启文件变化推送时启动监听线程"""
+    if WATCH_ENABLED and get_prompt_server():
+        CHANGE_WATCHER.start()
+
+
+_deferred_init_done = False
+
+
+def run_deferred_init():
+    """
+    首个插件请求到达时执行一次：创建工作流和input目录、启动预编译预热和文件变化监听
+    导入时只注册路由，这些工作不计入ComfyUI启动时间；没有Photoshop客户端连接的节点不会启动后台线程
+    """
+    global _deferred_init_done
+    if _deferred_init_done:
+        return
+    _deferred_init_done = True
+    os.makedirs(WORKFLOW_DIR, exist_ok=True)
+    get_input_dir()  # 解析并创建input目录，之后的请求直接使用结果
+    start_precompile_warmup()
+    start_change_watcher()
+
+
+def with_deferred_init(handler):
+    """处理请求前确保 run_deferred_init 已执行"""
+
+    @functools.wraps(handler)
+    async def wrapper(request):
+        if not _deferred_init_done:
+            run_deferred_init()
+        return await handler(request)
+
+    return wrapper
+
+
+def make_too_many_requests_response():
+    """客户端并发超限时的429响应"""
+    return web.Response(status=429, text="请求过多，请稍后重试", headers={"Retry-After": str(CLIENT_RETRY_AFTER)})
+
+
+def get_client_key(request):
+    """限制并发时区分客户端的键：配置了 CLIENT_KEY_HEADER 且请求带该头时取其第一个值，否则为对端地址"""
+    if CLIENT_KEY_HEADER:
+        value = request.headers.get(CLIENT_KEY_HEADER, "").split(",")[0].strip()
+        if value:
+            return value
+    return request.remote or ""
+
+
+def limit_client_concurrency(handler, wait=False):
+    """
+    记录路由请求所属的客户端，供 SingleFlight 发起新计算时按客户端限制并发；上限为0时原样返回处理函数
+    wait=True（批量请求）时超限的计算等待名额而不是返回429
+    """
+    if CLIENT_CONCURRENCY <= 0:
+        return handler
+
+    @functools.wraps(handler)
+    async def wrapper(request):
+        # 每个请求在独立任务中处理，设置的值不会影响其它请求
+        CURRENT_CLIENT.set(get_client_key(request))
+        if wait:
+            CLIENT_LIMIT_WAIT.set(True)
+        return await handler(request)
+
+    return wrapper
+
+
 # 注册新路由的函数
+def get_route_label(path):
+    """去掉路由路径中的正则约束作为指标标签，如 /workflows/{filename:.*\\.json} -> /workflows/{filename}"""
+    return re.sub(r"\{(\w+):[^}]*\}", r"{\1}", path)
+
+
+def instrument_handler(route, handler):
+    """为路由处理函数加上请求计数和耗时直方图；指标关闭时原样返回处理函数"""
+    if not METRICS_ENABLED:
+        return handler
+
+    @functools.wraps(handler)
+    async def wrapper(request):
+        started_at = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        except asyncio.CancelledError:
+            status = 499  # 客户端在响应完成前断开
+            raise
+        finally:
+            METRICS.inc(
+                "ps_comfy_tiheaven_http_requests_total",
+                (("route", route), ("method", request.method), ("status", status)),
+            )
+            METRICS.observe(
+                "ps_comfy_tiheaven_http_request_duration_seconds",
+                time.perf_counter() - started_at,
+                (("route", route), ("method", request.method)),
+            )
+
+    return wrapper
+
+
+def add_instrumented_routes(server, routes, deferred_init=True):
+    """
+    把路由表添加到服务器，每个处理函数都经过 instrument_handler 统计
+    deferred_init=True 的插件路由在首个请求时执行延迟初始化；监控类路由传 False，抓取指标不会启动后台线程
+    """
+    server.app.router.add_routes([
+        web.RouteDef(
+            route.method, route.path,
+            instrument_handler(
+                get_route_label(route.path), with_deferred_init(route.handler) if deferred_init else route.handler
+            ),
+            route.kwargs
+        )
+        for route in routes
+    ])
+
+
 def register_thumbnail_route():
     """注册缩略图路由到ComfyUI的PromptServer"""
-    server = PromptServer.instance
+    server = get_prompt_server()
     if not server:
         logger.error("注册缩略图路由失败：未找到 PromptServer 实例")
         return
 
     # 定义并注册路由
     thumbnail_routes = web.RouteTableDef()
-    thumbnail_routes.get("/ps-comfy-tiheaven-get-thumbnail/{filename:.*}")(handle_get_thumbnail)
-    PromptServer.instance.app.router.add_routes(thumbnail_routes)
+    thumbnail_routes.get("/ps-comfy-tiheaven-get-thumbnail/{filename:.*}")(limit_client_concurrency(handle_get_thumbnail))
+    thumbnail_routes.post("/ps-comfy-tiheaven-get-thumbnails")(limit_client_concurrency(handle_get_thumbnails, wait=True))
+    thumbnail_routes.get("/ps-comfy-tiheaven-get-region/{filename:.*}")(limit_client_concurrency(handle_get_region))
+    add_instrumented_routes(server, thumbnail_routes)
     #logger.info("成功注册缩略图路由：/ps-comfy-tiheaven-get-thumbnail")
 
 
 def register_appinfo_route():
     """注册路由到ComfyUI的PromptServer"""
-    server = PromptServer.instance
+    server = get_prompt_server()
     if not server:
         logger.error("注册路由失败：未找到 PromptServer 实例")
         return
@@ -557,12 +3573,39 @@ def register_appinfo_route():
     # 定义并注册路由
     appinfo_routes = web.RouteTableDef()
     appinfo_routes.get("/ps-comfy-tiheaven-appinfo")(handle_get_appinfo)
-    PromptServer.instance.app.router.add_routes(appinfo_routes)
+    appinfo_routes.get("/ps-comfy-tiheaven-manifest")(handle_get_manifest)
+    add_instrumented_routes(server, appinfo_routes)
     #logger.info("成功注册无依赖版路由：/ps-comfy-tiheaven-appinfo")
         
+def register_executor_stats_route():
+    """注册执行器统计和Prometheus指标路由"""
+    server = get_prompt_server()
+    if not server:
+        logger.error("注册执行器统计路由失败：未找到 PromptServer 实例")
+        return
+
+    stats_routes = web.RouteTableDef()
+    stats_routes.get("/ps-comfy-tiheaven-executor-stats")(handle_get_executor_stats)
+    stats_routes.get("/ps-comfy-tiheaven-metrics")(handle_get_metrics)
+    add_instrumented_routes(server, stats_routes, deferred_init=False)
+
+def register_profile_routes():
+    """开启性能分析时注册分析文件的列表和下载路由"""
+    if not PROFILE_ENABLED:
+        return
+    server = get_prompt_server()
+    if not server:
+        logger.error("注册性能分析路由失败：未找到 PromptServer 实例")
+        return
+
+    profile_routes = web.RouteTableDef()
+    profile_routes.get("/ps-comfy-tiheaven-profiles")(list_profiles)
+    profile_routes.get("/ps-comfy-tiheaven-profiles/{name}")(handle_get_profile)
+    add_instrumented_routes(server, profile_routes, deferred_init=False)
+
 def register_workflow_routes():
     """向 ComfyUI 服务器注册工作流相关路由"""
-    server = PromptServer.instance
+    server = get_prompt_server()
     if not server:
         logger.error("注册路由失败：未找到 PromptServer 实例")
         return
@@ -571,17 +3614,17 @@ def register_workflow_routes():
     custom_routes = web.RouteTableDef()
     
     # 仅匹配以 .json 结尾的文件名（使用正则约束）
-    custom_routes.get(r"/workflows/{filename:.*\.json}")(handle_get_workflow)
+    custom_routes.get(r"/workflows/{filename:.*\.json}")(limit_client_concurrency(handle_get_workflow))
     # 目录路由保持不变（匹配所有其他路径）
     custom_routes.get("/workflows/{subpath:.*}")(list_workflows)
 
     # 将路由添加到服务器
-    server.app.router.add_routes(custom_routes)
+    add_instrumented_routes(server, custom_routes)
     #logger.info("工作流路由已成功挂钩：支持目录列表和文件获取")
 
 def register_locale_routes():
     """注册语言文件相关路由"""
-    server = PromptServer.instance
+    server = get_prompt_server()
     if not server:
         logger.error("注册语言路由失败：未找到 PromptServer 实例")
         return
@@ -592,16 +3635,23 @@ def register_locale_routes():
     locale_routes.get("/ps-comfy-tiheaven-locales/")(list_locales)
     # 获取指定语言文件内容
     locale_routes.get(r"/ps-comfy-tiheaven-locales/{filename:.*\.json}")(handle_get_locale)
+    # 一次获取全部（或指定）语言包
+    locale_routes.get("/ps-comfy-tiheaven-locales-bundle")(handle_get_locale_bundle)
 
-    server.app.router.add_routes(locale_routes)
+    add_instrumented_routes(server, locale_routes)
     #logger.info("语言文件路由已成功注册")
 
 # 初始化时自动注册路由
-register_workflow_routes()
-register_locale_routes()
-register_appinfo_route()
-register_thumbnail_route()
-
+if not STANDALONE:
+    register_workflow_routes()
+    register_locale_routes()
+    register_appinfo_route()
+    register_thumbnail_route()
+    register_executor_stats_route()
+    register_profile_routes()
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED_AT
+logger.info(f"[Ps-Comfy-TiHeaveN]: 导入耗时 {IMPORT_SECONDS * 1000:.1f}ms（后台任务在首个插件请求时启动）")
 logger.info(f"[Ps-Comfy-TiHeaveN]: If you see me, it means the loading has been successfully completed, Please download the Photoshop plugin from https://github.com/tiheaven/Ps-Comfy-TiHeaveN-CustomNodes/releases")
 
 # 不注册任何节点（必须留空）
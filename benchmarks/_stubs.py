@@ -0,0 +1,97 @@
+"""离线运行基准测试所需的ComfyUI桩模块（folder_paths / server / comfy_execution.graph_utils）"""
+import os
+import sys
+import types
+import tempfile
+import importlib.util
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "ps_comfy_tiheaven"
+
+
+class Node:
+    """与 comfy_execution.graph_utils.Node 序列化行为一致的最小实现"""
+
+    def __init__(self, id, class_type, inputs):
+        self.id = id
+        self.class_type = class_type
+        self.inputs = inputs
+
+    def serialize(self):
+        return {
+            "class_type": self.class_type,
+            "inputs": {
+                key: value.serialize() if isinstance(value, Node) else value
+                for key, value in self.inputs.items()
+            },
+        }
+
+
+class GraphBuilder:
+    """与 comfy_execution.graph_utils.GraphBuilder 行为一致的最小实现"""
+
+    def __init__(self, prefix=None):
+        self.prefix = prefix or ""
+        self.nodes = {}
+
+    def node(self, class_type, id=None, **kwargs):
+        id = self.prefix + str(id if id is not None else len(self.nodes) + 1)
+        if id in self.nodes:
+            return self.nodes[id]
+        node = Node(id, class_type, kwargs)
+        self.nodes[id] = node
+        return node
+
+    def finalize(self):
+        return {node_id: node.serialize() for node_id, node in self.nodes.items()}
+
+
+def install_stubs(base_path=None):
+    """注册桩模块并返回模拟的ComfyUI根目录"""
+    from aiohttp import web
+
+    base_path = base_path or tempfile.mkdtemp(prefix="ps-comfy-tiheaven-bench-")
+
+    folder_paths = types.ModuleType("folder_paths")
+    folder_paths.base_path = base_path
+    folder_paths.get_directory_by_type = lambda type_name: os.path.join(base_path, type_name)
+
+    class PromptServer:
+        instance = None
+
+        def __init__(self):
+            self.app = web.Application()
+            self.sent_events = []
+
+        def send_sync(self, event, data, sid=None):
+            self.sent_events.append((event, data, sid))
+
+    PromptServer.instance = PromptServer()
+    server = types.ModuleType("server")
+    server.PromptServer = PromptServer
+
+    comfy_execution = types.ModuleType("comfy_execution")
+    graph_utils = types.ModuleType("comfy_execution.graph_utils")
+    graph_utils.GraphBuilder = GraphBuilder
+    graph_utils.Node = Node
+    comfy_execution.graph_utils = graph_utils
+
+    sys.modules["folder_paths"] = folder_paths
+    sys.modules["server"] = server
+    sys.modules["comfy_execution"] = comfy_execution
+    sys.modules["comfy_execution.graph_utils"] = graph_utils
+    return base_path
+
+
+def load_package(base_path=None):
+    """安装桩模块后按ComfyUI的方式加载本节点包，返回模块对象"""
+    if PACKAGE_NAME in sys.modules:
+        return sys.modules[PACKAGE_NAME]
+    install_stubs(base_path)
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME, os.path.join(PACKAGE_DIR, "__init__.py"), submodule_search_locations=[PACKAGE_DIR]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = module
+    spec.loader.exec_module(module)
+    return module
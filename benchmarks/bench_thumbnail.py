@@ -0,0 +1,108 @@
+"""缩略图生成基准：对比原始实现（原图分辨率合成 + Python回调掩码）与当前实现在各图像模式下的耗时
+
+用法：python benchmarks/bench_thumbnail.py [--size 4096] [--repeat 3]
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _stubs import load_package  # noqa: E402
+
+from PIL import Image  # noqa: E402
+
+
+def legacy_render_thumbnail(filepath):
+    """1.0.5 版本的缩略图实现，作为对比基线"""
+    with Image.open(filepath) as img:
+        original_exif = img.info.get('exif', b'')
+        if img.mode == "RGBA":
+            gray_bg = Image.new('RGB', img.size, (50, 50, 50))
+            rgb_img = img.convert('RGB')
+            alpha_channel = img.split()[3]
+
+            def calculate_mask(x):
+                if x == 255:
+                    return 255
+                return int((255 - x) * 0.25)
+            mixed_alpha = alpha_channel.point(calculate_mask)
+            processed_img = Image.composite(rgb_img, gray_bg, mixed_alpha)
+        elif img.mode in ["L", "LA"]:
+            rgb_img = Image.new('RGB', img.size, (100, 100, 100))
+            if img.mode == "LA":
+                _, a = img.split()
+            else:
+                a = img
+            white_layer = Image.new('RGB', img.size, (255, 255, 255))
+            rgb_img.paste(white_layer, mask=a)
+            processed_img = rgb_img
+        else:
+            processed_img = img.convert("RGB")
+
+        width, height = processed_img.size
+        if width > height:
+            new_width = 120
+            new_height = int((height / width) * new_width)
+        else:
+            new_height = 120
+            new_width = int((width / height) * new_height)
+        thumbnail = processed_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format="JPEG", quality=90, exif=original_exif)
+        return buffer.getvalue()
+
+
+def make_images(directory, size):
+    """生成各模式的测试图像：带渐变透明选区的大图层（Photoshop选区导出的常见情况）"""
+    width, height = size, size * 3 // 4
+    content = Image.effect_noise((width // 8, height // 8), 64).convert("RGB").resize((width, height))
+    selection = Image.radial_gradient("L").resize((width, height))
+    images = {}
+
+    rgba = content.convert("RGBA")
+    rgba.putalpha(selection)
+    images["RGBA"] = os.path.join(directory, "layer_rgba.png")
+    rgba.save(images["RGBA"])
+
+    la = Image.merge("LA", [content.convert("L"), selection])
+    images["LA"] = os.path.join(directory, "layer_la.png")
+    la.save(images["LA"])
+
+    images["L"] = os.path.join(directory, "mask_l.png")
+    selection.save(images["L"])
+
+    images["RGB (JPEG)"] = os.path.join(directory, "photo_rgb.jpg")
+    content.save(images["RGB (JPEG)"], quality=90)
+    return images
+
+
+def measure(func, filepath, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func(filepath)
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=4096, help="测试图像宽度（高度为宽度的3/4）")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最短耗时")
+    args = parser.parse_args()
+
+    package = load_package()
+    with tempfile.TemporaryDirectory() as directory:
+        images = make_images(directory, args.size)
+        print(f"{'mode':<12}{'legacy ms':>12}{'current ms':>12}{'speedup':>10}")
+        for mode, filepath in images.items():
+            legacy = measure(legacy_render_thumbnail, filepath, args.repeat)
+            current = measure(package.render_thumbnail, filepath, args.repeat)
+            print(f"{mode:<12}{legacy * 1000:>12.1f}{current * 1000:>12.1f}{legacy / current:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+基准测试入口：离线运行（使用桩模块代替ComfyUI），结果写入JSON文件以便在版本之间追踪回归
+
+用法：
+    python benchmarks/run.py                       # 运行全部测试
+    python benchmarks/run.py --suite convert       # 只测工作流转换
+    python benchmarks/run.py --output results.json --concurrency 32 --requests 500
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import platform
+import argparse
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _stubs import load_package  # noqa: E402
+from synthetic import make_workflow  # noqa: E402
+
+# 转换测试的规模档位：(名称, make_workflow参数)
+CONVERT_SCALES = [
+    ("small", {"nodes": 50, "reroute_chain": 0, "muted_ratio": 0.0, "widgets": 4}),
+    ("medium", {"nodes": 200, "reroute_chain": 2, "muted_ratio": 0.1, "widgets": 6}),
+    ("large", {"nodes": 600, "reroute_chain": 3, "muted_ratio": 0.2, "widgets": 8}),
+    ("xlarge", {"nodes": 2000, "reroute_chain": 5, "muted_ratio": 0.2, "widgets": 8}),
+]
+
+
+def percentile(values, ratio):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(ratio * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(durations):
+    """将耗时列表（秒）汇总为毫秒统计"""
+    return {
+        "count": len(durations),
+        "min_ms": round(min(durations) * 1000, 3),
+        "mean_ms": round(statistics.mean(durations) * 1000, 3),
+        "p50_ms": round(percentile(durations, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(durations, 0.95) * 1000, 3),
+        "max_ms": round(max(durations) * 1000, 3),
+    }
+
+
+def bench_convert(package, repeat):
+    """测量各规模工作流的转换耗时与峰值内存"""
+    results = []
+    for name, params in CONVERT_SCALES:
+        workflow = make_workflow(**params)
+        durations = []
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            package.convert_workflow_format(workflow)
+            durations.append(time.perf_counter() - started_at)
+
+        tracemalloc.start()
+        package.convert_workflow_format(workflow)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results.append({
+            "scale": name,
+            "params": params,
+            "node_count": len(workflow["nodes"]),
+            "link_count": len(workflow["links"]),
+            "peak_memory_kb": round(peak / 1024, 1),
+            **summarize(durations)
+        })
+        print(f"convert {name:<7} nodes={len(workflow['nodes']):<6} links={len(workflow['links']):<6} "
+              f"p50={results[-1]['p50_ms']}ms peak={results[-1]['peak_memory_kb']}KB")
+    return results
+
+
+def prepare_route_fixtures(package):
+    """在模拟的ComfyUI目录中写入测试工作流和图片"""
+    from PIL import Image
+
+    workflow_dir = os.path.join(package.WORKFLOW_DIR, "bench")
+    os.makedirs(workflow_dir, exist_ok=True)
+    for name, params in CONVERT_SCALES[:3]:
+        with open(os.path.join(workflow_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(make_workflow(**params), f)
+
+    image = Image.effect_noise((512, 384), 64).convert("RGB").resize((2048, 1536))
+    image.save(os.path.join(package.get_input_dir(), "bench.jpg"), quality=90)
+    rgba = image.convert("RGBA")
+    rgba.putalpha(Image.radial_gradient("L").resize(image.size))
+    rgba.save(os.path.join(package.get_input_dir(), "bench.png"))
+
+
+async def bench_routes(package, concurrency, total_requests):
+    """使用aiohttp测试客户端在并发压力下测量各路由的延迟与吞吐"""
+    from aiohttp.test_utils import TestClient, TestServer
+    from server import PromptServer
+
+    prepare_route_fixtures(package)
+    targets = [
+        ("workflow_small", "/workflows/bench/small.json"),
+        ("workflow_large", "/workflows/bench/large.json"),
+        ("workflow_list", "/workflows/bench/"),
+        ("workflow_list_recursive", "/workflows/?recursive=1"),
+        ("locale", "/ps-comfy-tiheaven-locales/en_US.json"),
+        ("appinfo", "/ps-comfy-tiheaven-appinfo"),
+        ("thumbnail_jpeg", "/ps-comfy-tiheaven-get-thumbnail/bench.jpg"),
+        ("thumbnail_rgba", "/ps-comfy-tiheaven-get-thumbnail/bench.png"),
+    ]
+
+    results = []
+    async with TestClient(TestServer(PromptServer.instance.app)) as client:
+        for name, url in targets:
+            # 首次请求（冷缓存）单独计时
+            started_at = time.perf_counter()
+            response = await client.get(url)
+            await response.read()
+            cold = time.perf_counter() - started_at
+            if response.status != 200:
+                print(f"route {name}: HTTP {response.status}, skipped")
+                continue
+
+            durations = []
+            errors = []
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one_request():
+                async with semaphore:
+                    request_started_at = time.perf_counter()
+                    request_response = await client.get(url)
+                    await request_response.read()
+                    if request_response.status != 200:
+                        errors.append(request_response.status)
+                    durations.append(time.perf_counter() - request_started_at)
+
+            started_at = time.perf_counter()
+            await asyncio.gather(*[one_request() for _ in range(total_requests)])
+            elapsed = time.perf_counter() - started_at
+
+            results.append({
+                "route": name,
+                "url": url,
+                "concurrency": concurrency,
+                "cold_ms": round(cold * 1000, 3),
+                "throughput_rps": round(total_requests / elapsed, 1),
+                "errors": len(errors),
+                **summarize(durations)
+            })
+            print(f"route {name:<24} cold={results[-1]['cold_ms']}ms p50={results[-1]['p50_ms']}ms "
+                  f"p95={results[-1]['p95_ms']}ms {results[-1]['throughput_rps']}req/s errors={len(errors)}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", choices=["all", "convert", "routes"], default="all")
+    parser.add_argument("--repeat", type=int, default=5, help="每个转换规模的重复次数")
+    parser.add_argument("--concurrency", type=int, default=16, help="路由测试的并发请求数")
+    parser.add_argument("--requests", type=int, default=200, help="每个路由的请求总数")
+    parser.add_argument("--output", default="bench_results.json", help="结果输出文件（JSON）")
+    args = parser.parse_args()
+
+    # 所有并发请求都来自同一地址，关闭按客户端的并发上限，否则超出的请求会以429计入耗时
+    os.environ.setdefault("PS_COMFY_TIHEAVEN_CLIENT_CONCURRENCY", "0")
+    package = load_package()
+    base_path = sys.modules["folder_paths"].base_path
+    results = {
+        "version": package.get_app_version(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    try:
+        if args.suite in ("all", "convert"):
+            results["convert"] = bench_convert(package, args.repeat)
+        if args.suite in ("all", "routes"):
+            results["routes"] = asyncio.run(bench_routes(package, args.concurrency, args.requests))
+    finally:
+        package.WORKFLOW_CATALOG.stop()
+        shutil.rmtree(base_path, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
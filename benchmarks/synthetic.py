@@ -0,0 +1,89 @@
+"""合成工作流生成器：按规模生成UI格式工作流，包含Reroute链、静音节点和widget输入"""
+import random
+
+# 被过滤的widget控制值，与 convert_workflow_format 中的过滤列表一致
+CONTROL_VALUES = ["randomize", "fixed", "increment", "decrement"]
+
+
+def make_workflow(nodes=100, reroute_chain=2, muted_ratio=0.1, widgets=4, fan_in=2, seed=0):
+    """
+    生成合成工作流
+    nodes: 正常节点数量；reroute_chain: 每条连接插入的Reroute节点数；muted_ratio: mode=4节点比例
+    widgets: 每个节点的widget输入数；fan_in: 每个节点连接的上游节点数
+    """
+    rnd = random.Random(seed)
+    workflow_nodes = []
+    links = []
+    next_id = [0]
+
+    def new_id():
+        next_id[0] += 1
+        return next_id[0]
+
+    def add_link(source_id, target_id, target_slot, link_type):
+        link_id = len(links) + 1
+        links.append([link_id, source_id, 0, target_id, target_slot, link_type])
+        return link_id
+
+    created = []
+    for order in range(nodes):
+        node_id = new_id()
+        inputs = [
+            {
+                "name": f"widget_{index}",
+                "localized_name": f"widget_{index}",
+                "type": "INT",
+                "widget": {"name": f"widget_{index}"},
+                "link": None
+            }
+            for index in range(widgets)
+        ]
+        widgets_values = []
+        for index in range(widgets):
+            widgets_values.append(rnd.randint(0, 1 << 32))
+            # 模拟seed控件后跟随的控制值
+            if index % 2 == 0:
+                widgets_values.append(rnd.choice(CONTROL_VALUES))
+
+        node = {
+            "id": node_id,
+            "type": "KSampler",
+            "mode": 4 if rnd.random() < muted_ratio else 0,
+            "order": order,
+            "title": f"#{order:03d} 节点",
+            "inputs": inputs,
+            "outputs": [{"name": "LATENT", "type": "LATENT", "links": []}],
+            "widgets_values": widgets_values
+        }
+
+        for slot in range(min(fan_in, len(created))):
+            source_id = rnd.choice(created)
+            # 在连接中插入Reroute链
+            for _ in range(reroute_chain):
+                reroute_id = new_id()
+                reroute = {
+                    "id": reroute_id,
+                    "type": "Reroute",
+                    "inputs": [{"name": "", "type": "*", "link": None}],
+                    "outputs": [{"name": "", "type": "LATENT", "links": []}]
+                }
+                reroute["inputs"][0]["link"] = add_link(source_id, reroute_id, 0, "LATENT")
+                workflow_nodes.append(reroute)
+                source_id = reroute_id
+            node["inputs"].append({
+                "name": f"latent_{slot}",
+                "localized_name": f"latent_{slot}",
+                "type": "LATENT",
+                "link": add_link(source_id, node_id, len(node["inputs"]), "LATENT")
+            })
+
+        workflow_nodes.append(node)
+        created.append(node_id)
+
+    return {
+        "last_node_id": next_id[0],
+        "last_link_id": len(links),
+        "nodes": workflow_nodes,
+        "links": links,
+        "version": 0.4
+    }
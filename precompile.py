@@ -0,0 +1,53 @@
+"""
+预编译命令行入口：在ComfyUI根目录下运行，将 user/default/workflows 中所有工作流的转换结果写入预编译缓存
+之后以 PS_COMFY_TIHEAVEN_PRECOMPILE=1 启动的服务器首次加载工作流时直接读取缓存，无需转换
+（适合在构建镜像或扩容实例启动前执行）
+
+用法：
+    cd ComfyUI
+    python custom_nodes/Ps-Comfy-TiHeaveN-CustomNodes/precompile.py
+    python custom_nodes/Ps-Comfy-TiHeaveN-CustomNodes/precompile.py --workers 8
+"""
+import os
+import sys
+import time
+import argparse
+import importlib.util
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_NAME = "ps_comfy_tiheaven_precompile"
+
+
+def load_package():
+    """
+    以预编译模式独立加载本节点包：folder_paths、comfy_execution 从当前目录即ComfyUI根目录导入，
+    不导入ComfyUI的server模块（及其连带的nodes、execution、torch），也不注册路由
+    """
+    os.environ["PS_COMFY_TIHEAVEN_PRECOMPILE"] = "1"
+    os.environ["PS_COMFY_TIHEAVEN_STANDALONE"] = "1"
+    sys.path.insert(0, os.getcwd())
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME, os.path.join(PACKAGE_DIR, "__init__.py"), submodule_search_locations=[PACKAGE_DIR]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预编译全部工作流并写入预编译缓存")
+    parser.add_argument("--workers", type=int, default=None, help="并行数（默认取 PS_COMFY_TIHEAVEN_PRECOMPILE_WORKERS 或CPU核数）")
+    parser.add_argument("--threads", action="store_true", help="使用线程池（默认在本进程中使用进程池并行转换）")
+    args = parser.parse_args()
+
+    package = load_package()
+    started_at = time.perf_counter()
+    # 独立加载不导入server、不启动任何后台线程，此时fork进程池不会复制其它线程持有的锁
+    succeeded, failed = package.precompile_workflows(args.workers, use_processes=not args.threads)
+    print(f"预编译完成：成功 {succeeded} 个，失败 {failed} 个，耗时 {time.perf_counter() - started_at:.2f}s（{package.WORKFLOW_DIR}）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""测试公共夹具：用 benchmarks/_stubs 的桩模块离线加载本节点包"""
+import os
+import sys
+import asyncio
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from _stubs import load_package  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def package():
+    """加载后的节点包模块；关闭文件变化监听，避免测试中启动后台线程"""
+    os.environ.setdefault("PS_COMFY_TIHEAVEN_WATCH", "0")
+    module = load_package(tempfile.mkdtemp(prefix="ps-comfy-tiheaven-test-"))
+    os.makedirs(module.WORKFLOW_DIR, exist_ok=True)
+    return module
+
+
+@pytest.fixture
+def write_workflow(package):
+    """在工作流目录中写入文件并返回相对路径"""
+    written = []
+
+    def write(name, content):
+        path = os.path.join(package.WORKFLOW_DIR, name)
+        with open(path, "wb") as f:
+            f.write(content if isinstance(content, bytes) else content.encode("utf-8"))
+        written.append(path)
+        return name
+
+    yield write
+    for path in written:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@pytest.fixture(scope="session")
+def event_loop_for_app():
+    """所有请求共用一个事件循环：aiohttp应用和节点包内的异步对象（执行器信号量等）绑定在首次使用的循环上"""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def request_app(package, event_loop_for_app):
+    """在测试客户端上执行协程函数：request_app(lambda client: ...) 返回协程的结果"""
+    from aiohttp.test_utils import TestClient, TestServer
+    from server import PromptServer
+
+    def run(coro_fn):
+        async def main():
+            async with TestClient(TestServer(PromptServer.instance.app)) as client:
+                return await coro_fn(client)
+
+        return event_loop_for_app.run_until_complete(main())
+
+    return run
@@ -0,0 +1,15 @@
+"""
+pytest插件（由 pyproject.toml 的 addopts 加载）：把仓库根目录作为普通目录收集
+根目录的 __init__.py 就是节点包本身，pytest默认会把它当作测试包导入，而它依赖只在ComfyUI中存在的 folder_paths、server；
+测试通过 conftest.py 中的 package 夹具在桩模块上加载节点包
+"""
+import os
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pytest_collect_directory(path, parent):
+    if str(path) == ROOT_DIR:
+        return pytest.Dir.from_parent(parent, path=path)
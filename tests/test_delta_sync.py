@@ -0,0 +1,163 @@
+"""增量同步：diff_json 生成的 JSON Patch（RFC 6902）应用到旧版本后必须得到新版本"""
+import copy
+import json
+import os
+import random
+
+import pytest
+
+from synthetic import make_workflow
+
+
+def parse_pointer(path):
+    """按RFC 6901拆分JSON Pointer"""
+    if path == "":
+        return []
+    assert path.startswith("/")
+    return [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+
+
+def apply_patch(document, ops):
+    """最小的RFC 6902实现（只包含 diff_json 会生成的 add/remove/replace），返回新文档"""
+    document = copy.deepcopy(document)
+    for op in ops:
+        tokens = parse_pointer(op["path"])
+        if not tokens:
+            assert op["op"] == "replace"
+            document = copy.deepcopy(op["value"])
+            continue
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        last = tokens[-1]
+        if isinstance(parent, list):
+            if op["op"] == "add":
+                index = len(parent) if last == "-" else int(last)
+                assert 0 <= index <= len(parent)
+                parent.insert(index, copy.deepcopy(op["value"]))
+            elif op["op"] == "remove":
+                del parent[int(last)]
+            else:
+                parent[int(last)] = copy.deepcopy(op["value"])
+        else:
+            if op["op"] == "add":
+                assert last not in parent
+                parent[last] = copy.deepcopy(op["value"])
+            elif op["op"] == "remove":
+                del parent[last]
+            else:
+                assert last in parent
+                parent[last] = copy.deepcopy(op["value"])
+    return document
+
+
+def random_value(rnd, depth=0):
+    kind = rnd.randrange(6 if depth < 4 else 3)
+    if kind == 0:
+        return rnd.choice([0, 1, 1.5, -2, True, False, None, 10 ** 20])
+    if kind == 1:
+        return rnd.choice(["", "a", "b", "a/b", "~0", "中文"])
+    if kind == 2:
+        return rnd.randrange(3)
+    if kind == 3:
+        return [random_value(rnd, depth + 1) for _ in range(rnd.randrange(5))]
+    return {rnd.choice(["a", "b", "c", "a/b", "~", "~1", "", "中"]): random_value(rnd, depth + 1) for _ in range(rnd.randrange(5))}
+
+
+def mutate(rnd, value, depth=0):
+    """在 value 的基础上随机修改，使新旧版本大部分相同"""
+    if isinstance(value, dict) and rnd.random() < 0.8:
+        result = {key: mutate(rnd, item, depth + 1) if rnd.random() < 0.5 else item for key, item in value.items()}
+        for key in list(result):
+            if rnd.random() < 0.15:
+                del result[key]
+        if rnd.random() < 0.3:
+            result[rnd.choice(["a", "new", "x/y", "~z"])] = random_value(rnd, depth + 1)
+        return result
+    if isinstance(value, list) and rnd.random() < 0.8:
+        result = [mutate(rnd, item, depth + 1) if rnd.random() < 0.5 else item for item in value]
+        if result and rnd.random() < 0.3:
+            del result[rnd.randrange(len(result)):]
+        if rnd.random() < 0.3:
+            result.extend(random_value(rnd, depth + 1) for _ in range(rnd.randrange(1, 3)))
+        return result
+    return random_value(rnd, depth) if rnd.random() < 0.5 else value
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_patch_round_trip(package, seed):
+    rnd = random.Random(seed)
+    for _ in range(100):
+        old = random_value(rnd)
+        new = mutate(rnd, old) if rnd.random() < 0.8 else random_value(rnd)
+        snapshot = copy.deepcopy(old)
+        ops = package.diff_json(old, new)
+        assert old == snapshot
+        assert apply_patch(old, ops) == new
+        # 补丁经过JSON序列化传输后仍然有效
+        assert apply_patch(old, json.loads(json.dumps(ops))) == new
+
+
+def test_pointer_tokens_are_escaped(package):
+    old = {"a/b": {"~": 1}, "keep": [1, 2, 3]}
+    new = {"a/b": {"~": 2}, "keep": [1], "c~/d": True}
+    ops = package.diff_json(old, new)
+    assert {"op": "replace", "path": "/a~1b/~0", "value": 2} in ops
+    assert {"op": "add", "path": "/c~0~1d", "value": True} in ops
+    # 多余的数组元素从末尾往前删除
+    assert [op["path"] for op in ops if op["op"] == "remove"] == ["/keep/2", "/keep/1"]
+    assert apply_patch(old, ops) == new
+
+
+def test_type_changes_replace_the_value(package):
+    for old, new in ((1, True), (0, 0.0), ([1], {"0": 1}), ({"a": 1}, None), ("1", 1)):
+        ops = package.diff_json({"v": old}, {"v": new})
+        assert ops == [{"op": "replace", "path": "/v", "value": new}]
+    assert package.diff_json([1], {"a": 1}) == [{"op": "replace", "path": "", "value": {"a": 1}}]
+    assert package.diff_json({"a": [1, {"b": 2}]}, {"a": [1, {"b": 2}]}) == []
+
+
+def test_patch_not_smaller_than_body_is_skipped(package):
+    old = json.dumps({"a": 1}).encode("utf-8")
+    new = json.dumps({"b": 2}).encode("utf-8")
+    assert package.build_workflow_patch(old, new) is None
+    old = json.dumps({"nodes": list(range(200)), "x": 1}).encode("utf-8")
+    new = json.dumps({"nodes": list(range(200)), "x": 2}).encode("utf-8")
+    assert json.loads(package.build_workflow_patch(old, new)) == [{"op": "replace", "path": "/x", "value": 2}]
+
+
+def test_delta_response_applies_to_previous_version(package, write_workflow, request_app):
+    workflow = make_workflow(nodes=40, seed=1)
+    name = write_workflow("delta.json", json.dumps(workflow))
+    path = os.path.join(package.WORKFLOW_DIR, name)
+
+    async def scenario(client):
+        first = await client.get(f"/workflows/{name}", headers={"Accept-Encoding": "identity"})
+        assert first.status == 200
+        old_body, old_etag = await first.json(), first.headers["ETag"]
+
+        unchanged = await client.get(f"/workflows/{name}", headers={"A-IM": "json-patch", "If-None-Match": old_etag})
+        assert unchanged.status == 304
+
+        # 修改一个widget值并确保文件签名变化
+        workflow["nodes"][3]["widgets_values"][0] = 987654
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(workflow, f)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        delta = await client.get(
+            f"/workflows/{name}",
+            headers={"A-IM": "json-patch", "If-None-Match": old_etag, "Accept-Encoding": "identity"},
+        )
+        assert delta.status == 226
+        assert delta.headers["IM"] == "json-patch"
+        assert delta.headers["Delta-Base"] == old_etag
+        ops = json.loads(await delta.read())
+
+        full = await client.get(f"/workflows/{name}", headers={"Accept-Encoding": "identity"})
+        assert full.headers["ETag"] == delta.headers["ETag"] != old_etag
+        return apply_patch(old_body, ops), await full.json()
+
+    patched, current = request_app(scenario)
+    assert patched == current
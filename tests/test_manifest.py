@@ -0,0 +1,43 @@
+"""清单：内容未变化时复用缓存的响应，工作流增删改后摘要立即更新"""
+import json
+import os
+
+
+def test_manifest_is_cached_until_catalog_changes(package, write_workflow):
+    first = package.build_manifest()
+    assert package.build_manifest() is first
+
+    name = write_workflow("manifest-added.json", json.dumps({"nodes": [], "links": []}))
+    added = package.build_manifest()
+    assert added is not first
+    before, after = json.loads(first.body), json.loads(added.body)
+    assert after["workflows"]["count"] == before["workflows"]["count"] + 1
+    assert after["workflows"]["digest"] == package.WORKFLOW_CATALOG.get_digest() != before["workflows"]["digest"]
+
+    # 原地修改（目录修改时间不变）也会反映在摘要中
+    path = os.path.join(package.WORKFLOW_DIR, name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"nodes": [{"id": 1}], "links": []}, f)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    modified = package.build_manifest()
+    assert json.loads(modified.body)["workflows"]["digest"] != after["workflows"]["digest"]
+
+
+def test_invalidate_drops_cached_manifest(package):
+    first = package.build_manifest()
+    package.invalidate_manifest()
+    rebuilt = package.build_manifest()
+    assert rebuilt is not first
+    assert rebuilt.body == first.body
+
+
+def test_manifest_conditional_request(package, request_app):
+    async def scenario(client):
+        first = await client.get("/ps-comfy-tiheaven-manifest")
+        assert first.status == 200
+        etag = first.headers["ETag"]
+        repeated = await client.get("/ps-comfy-tiheaven-manifest", headers={"If-None-Match": etag})
+        return repeated.status
+
+    assert request_app(scenario) == 304
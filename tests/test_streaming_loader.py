@@ -0,0 +1,138 @@
+"""流式工作流加载：JsonStreamReader 的块边界、UTF-8多字节字符、截断输入，以及413上限"""
+import io
+import json
+import random
+
+import pytest
+
+
+DOCUMENTS = [
+    [0, -0, 7, -12, 3.25, -1.5e-3, 6.02e23, 1E+2, 12345678901234567890, -0.0],
+    ["", "plain", "quote \" and \\ backslash", "é中文", "😀 emoji", "\\u escaped A", "tab\tnew\nline"],
+    [True, False, None, [], {}, [[]], {"": {}}],
+    [{"id": 1, "type": "LoadImage", "title": "中文标题", "widgets_values": ["a.png", "image", 1.0]}, [1, 2, 0, 3, 0, "IMAGE"]],
+    ["€" * 50, "😀" * 20, "x" * 300],
+]
+
+
+def read_array(package, data, chunk_size):
+    """用 JsonStreamReader 逐个读取顶层数组的元素"""
+    reader = package.JsonStreamReader(io.BytesIO(data), chunk_size=chunk_size)
+    reader.expect("[")
+    items = []
+    if reader.peek() == "]":
+        reader.expect("]")
+    else:
+        while True:
+            items.append(reader.read_value()[0])
+            if reader.expect(",]") == "]":
+                break
+    assert reader.peek() == ""
+    return items
+
+
+def random_value(rnd, depth=0):
+    kind = rnd.randrange(7 if depth < 3 else 4)
+    if kind == 0:
+        return rnd.choice([0, -1, 42, 10 ** 20, -(10 ** 18), rnd.uniform(-1e6, 1e6), rnd.uniform(-1, 1) * 1e-9])
+    if kind == 1:
+        return "".join(rnd.choice("ab \"\\/\n中文é😀€") for _ in range(rnd.randrange(12)))
+    if kind == 2:
+        return rnd.choice([True, False, None])
+    if kind == 3:
+        return rnd.randrange(-1000, 1000)
+    if kind == 4:
+        return [random_value(rnd, depth + 1) for _ in range(rnd.randrange(5))]
+    return {f"k{index}{rnd.choice('中é')}": random_value(rnd, depth + 1) for index in range(rnd.randrange(5))}
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 10))
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_values_split_at_any_chunk_boundary(package, document, chunk_size):
+    for separator in (",", " ,\n ", ",\t"):
+        data = ("[" + separator.join(json.dumps(item, ensure_ascii=False) for item in document) + "]").encode("utf-8")
+        assert read_array(package, data, chunk_size) == document
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 8])
+def test_random_documents_match_json_loads(package, chunk_size):
+    rnd = random.Random(chunk_size)
+    for _ in range(150):
+        document = [random_value(rnd) for _ in range(rnd.randrange(6))]
+        data = json.dumps(document, ensure_ascii=rnd.random() < 0.3, indent=rnd.choice([None, 1])).encode("utf-8")
+        assert read_array(package, data, chunk_size) == json.loads(data)
+
+
+def test_numbers_cut_by_chunk_are_read_whole(package):
+    # 每种块大小都会在某个数字的中间切断（如 "-1.5e" / "-3"）
+    data = b"[-1.5e-3,123456,2.5E+10,-7]"
+    for chunk_size in range(1, len(data) + 1):
+        assert read_array(package, data, chunk_size) == [-1.5e-3, 123456, 2.5e10, -7]
+
+
+def test_multibyte_utf8_split_between_reads(package):
+    text = "中😀é€"
+    data = json.dumps([text, {text: text}], ensure_ascii=False).encode("utf-8")
+    # 块大小为1时每个多字节字符都被拆到多次读取中
+    assert read_array(package, data, 1) == [text, {text: text}]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 64])
+def test_truncated_input_raises(package, chunk_size):
+    data = json.dumps(DOCUMENTS[0] + DOCUMENTS[1] + DOCUMENTS[3], ensure_ascii=False).encode("utf-8")
+    for cut in range(len(data)):
+        truncated = data[:cut]
+        try:
+            truncated.decode("utf-8")
+        except UnicodeDecodeError:
+            # 截断在多字节字符中间：增量解码器在文件末尾报错
+            with pytest.raises(ValueError):
+                read_array(package, truncated, chunk_size)
+            continue
+        with pytest.raises(json.JSONDecodeError):
+            read_array(package, truncated, chunk_size)
+
+
+def test_load_keeps_only_requested_keys(package, tmp_path):
+    workflow = {
+        "last_node_id": 2,
+        "nodes": [{"id": 1, "type": "LoadImage", "pos": [0, 0], "size": [1, 2], "title": "main", "widgets_values": ["a.png"]}],
+        "links": [[1, 1, 0, 2, 0, "IMAGE"]],
+        "groups": [{"title": "skipped"}],
+        "extra": {"ds": {"scale": 1}},
+    }
+    path = tmp_path / "workflow.json"
+    path.write_text(json.dumps(workflow, indent=2), encoding="utf-8")
+    loaded = package.load_workflow_streaming(str(path))
+    assert loaded == {
+        "nodes": [{"id": 1, "type": "LoadImage", "title": "main", "widgets_values": ["a.png"]}],
+        "links": [[1, 1, 0, 2, 0, "IMAGE"]],
+    }
+    assert package.load_workflow_streaming(str(path), keys=("nodes",)).keys() == {"nodes"}
+
+
+def test_retained_memory_limit(package, tmp_path):
+    path = tmp_path / "workflow.json"
+    path.write_text(json.dumps({"nodes": [{"id": index, "title": "x" * 100} for index in range(50)], "links": []}))
+    with pytest.raises(package.WorkflowTooLargeError):
+        package.load_workflow_streaming(str(path), max_memory_bytes=1000)
+    assert len(package.load_workflow_streaming(str(path), max_memory_bytes=0)["nodes"]) == 50
+
+
+def test_file_size_limit(package, monkeypatch, tmp_path):
+    path = tmp_path / "workflow.json"
+    path.write_text(json.dumps({"nodes": [], "links": [], "extra": {"padding": "x" * 2000}}))
+    monkeypatch.setattr(package, "MAX_WORKFLOW_BYTES", 1000)
+    with pytest.raises(package.WorkflowTooLargeError):
+        package.load_workflow_streaming(str(path))
+
+
+def test_oversized_workflow_returns_413(package, monkeypatch, write_workflow, request_app):
+    name = write_workflow("too-large.json", json.dumps({"nodes": [], "links": [], "extra": {"padding": "x" * 2000}}))
+    monkeypatch.setattr(package, "MAX_WORKFLOW_BYTES", 1000)
+
+    async def fetch(client):
+        response = await client.get(f"/workflows/{name}")
+        return response.status
+
+    assert request_app(fetch) == 413